@@ -0,0 +1,188 @@
+import math
+import time
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict
+
+# Recent wait times kept per stage for the averages in /status
+WAIT_SAMPLES = 1000
+
+
+class Overloaded(Exception):
+    """A request was turned away because the admission queue is full."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _percentile(samples, fraction: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class FairStage:
+    """
+    Concurrency limit for one pipeline stage with a round-robin queue across clients.
+
+    At most concurrency callers hold the stage at once. Waiters are queued per client
+    and a freed slot goes to the next client in turn, so one client with several
+    queries in flight can't starve the others. Runs on the event loop only.
+    """
+
+    def __init__(self, name: str, concurrency: int):
+        if concurrency < 1:
+            raise ValueError(f"Stage {name} needs a concurrency of at least 1")
+        self.name = name
+        self.concurrency = concurrency
+        self.active = 0
+        self.waiters: "OrderedDict[str, Deque[asyncio.Future]]" = OrderedDict()  # in turn order
+        self.queued = 0
+        self.peak_queued = 0
+        self.entered = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    async def acquire(self, client_id: str):
+        """Wait for a slot, taking turns with other clients' waiters."""
+        if self.active < self.concurrency and not self.queued:
+            self.active += 1
+            self._entered(0.0)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self.waiters.setdefault(client_id, deque()).append(future)
+        self.queued += 1
+        self.peak_queued = max(self.peak_queued, self.queued)
+        start_time = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was handed over as this caller was cancelled; pass it on
+                self.release()
+            else:
+                self._remove(client_id, future)
+            raise
+        self._entered(time.monotonic() - start_time)
+
+    def _entered(self, wait: float):
+        self.entered += 1
+        self.waits.append(wait)
+
+    def _remove(self, client_id: str, future: asyncio.Future):
+        queue = self.waiters.get(client_id)
+        if queue and future in queue:
+            queue.remove(future)
+            self.queued -= 1
+            if not queue:
+                del self.waiters[client_id]
+
+    def release(self):
+        """Hand the slot to the next client's oldest waiter, or free it."""
+        while self.waiters:
+            client_id, queue = next(iter(self.waiters.items()))
+            future = queue.popleft()
+            self.queued -= 1
+            # Move the client to the back of the turn order
+            del self.waiters[client_id]
+            if queue:
+                self.waiters[client_id] = queue
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self, client_id: str):
+        await self.acquire(client_id)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> dict:
+        waits = list(self.waits)
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": self.queued,
+            "clients_waiting": len(self.waiters),
+            "peak_queued": self.peak_queued,
+            "entered": self.entered,
+            "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 1) if waits else 0.0,
+            "p95_wait_ms": round(_percentile(waits, 0.95) * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """
+    Bounded admission in front of the query pipeline, plus its per-stage limits.
+
+    admit() lets at most max_pending queries into the pipeline, and at most
+    max_pending_per_client from one client; past that it raises Overloaded with a
+    Retry-After estimate instead of letting every query slow down. Admitted queries
+    queue fairly at each stage (see FairStage). Call done() when a query finishes.
+    """
+
+    def __init__(self, stages: Dict[str, int], max_pending: int = 32, max_pending_per_client: int = 4,
+                 max_retry_after: int = 60):
+        self.stages = {name: FairStage(name, concurrency) for name, concurrency in stages.items()}
+        self.max_pending = max_pending
+        self.max_pending_per_client = max_pending_per_client
+        self.max_retry_after = max_retry_after
+        self.pending: Dict[str, int] = {}
+        self.total_pending = 0
+        self.admitted = 0
+        self.rejected = {"full": 0, "client_limit": 0}
+        self.avg_request_seconds = None  # moving average of admitted query durations
+
+    def retry_after(self) -> int:
+        """Seconds until the current backlog should have drained through the narrowest stage."""
+        request_seconds = self.avg_request_seconds or 5.0
+        narrowest = min((stage.concurrency for stage in self.stages.values()), default=1)
+        seconds = math.ceil(request_seconds * max(self.total_pending, 1) / narrowest)
+        return max(1, min(self.max_retry_after, seconds))
+
+    def admit(self, client_id: str):
+        """Count a query in, or raise Overloaded if the queue or the client's share is full."""
+        if self.total_pending >= self.max_pending:
+            self.rejected["full"] += 1
+            raise Overloaded(f"Server busy: {self.total_pending} queries in progress", self.retry_after())
+        if self.pending.get(client_id, 0) >= self.max_pending_per_client:
+            self.rejected["client_limit"] += 1
+            raise Overloaded(f"Too many queries in progress from this client "
+                             f"(limit {self.max_pending_per_client})", self.retry_after())
+        self.pending[client_id] = self.pending.get(client_id, 0) + 1
+        self.total_pending += 1
+        self.admitted += 1
+
+    def done(self, client_id: str, seconds: float):
+        """Count a query out and fold its duration into the Retry-After estimate."""
+        self.pending[client_id] -= 1
+        if not self.pending[client_id]:
+            del self.pending[client_id]
+        self.total_pending -= 1
+        if self.avg_request_seconds is None:
+            self.avg_request_seconds = seconds
+        else:
+            self.avg_request_seconds = 0.8 * self.avg_request_seconds + 0.2 * seconds
+
+    def stage(self, name: str, client_id: str):
+        """Async context manager holding a slot of the named stage."""
+        return self.stages[name].slot(client_id)
+
+    def stats(self) -> dict:
+        return {
+            "pending": self.total_pending,
+            "max_pending": self.max_pending,
+            "max_pending_per_client": self.max_pending_per_client,
+            "clients": len(self.pending),
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "avg_request_seconds": round(self.avg_request_seconds, 4) if self.avg_request_seconds else None,
+            "retry_after": self.retry_after(),
+            "stages": {name: stage.stats() for name, stage in self.stages.items()},
+        }
@@ -0,0 +1,214 @@
+import os
+import re
+import json
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from EmbeddingCache import normalize_query
+from PartNumbers import extract_part_numbers, normalize_part_number
+
+# Append-only log of changed sources shared by ingest.py, /query/upload and the API workers
+ANSWER_CACHE_LOG = os.environ.get(
+    "ANSWER_CACHE_LOG",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "answer_cache_invalidations.log")
+)
+
+
+# Query tokens; those containing a digit (years, part and model numbers such as F-250,
+# quantities) must match for two questions to share an answer
+TOKEN_PATTERN = re.compile(r"[A-Za-z0-9]+(?:[-/.][A-Za-z0-9]+)*")
+
+
+def query_entities(query: str) -> frozenset:
+    """
+    Part numbers, years and other numbered tokens in a query, normalized. Two
+    questions only share a cached answer if these are identical, since embeddings
+    barely separate "KL50003 for a 2004" from "KL50004 for a 2006".
+    """
+    entities = {key for key, _ in extract_part_numbers(query, query=True)}
+    entities.update(normalize_part_number(token) for token in TOKEN_PATTERN.findall(query)
+                    if any(ch.isdigit() for ch in token))
+    return frozenset(entities)
+
+
+def publish_invalidation(sources: Iterable[str], log_path: str = ANSWER_CACHE_LOG):
+    """
+    Record that sources changed so every AnswerCache watching log_path (in this or
+    another process, e.g. the API after ingest.py runs) drops answers built from them.
+    """
+    sources = sorted(set(sources))
+    if not sources:
+        return
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"time": time.time(), "sources": sources}) + "\n")
+
+
+class AnswerCache:
+    """
+    Bounded in-memory cache of process_query answers.
+
+    Entries are found by exact normalized query text, or by cosine similarity of the
+    query embedding above a threshold within the same language and with the same
+    query_entities (part numbers, years, model numbers). Each entry keeps the sources
+    its answer was grounded in, and is dropped when any of them is reported changed
+    through the invalidation log; answers without sources are not cached. Entries expire
+    after ttl seconds and the least recently used entry is evicted when the cache is full.
+    """
+
+    def __init__(self, dim: int, max_size: int = 2048, ttl: float = 21600,
+                 threshold: float = 0.95, invalidation_log: str = ANSWER_CACHE_LOG):
+        self.dim = dim
+        self.max_size = max_size
+        self.ttl = ttl
+        self.threshold = threshold
+        self.invalidation_log = invalidation_log
+        self.lock = threading.Lock()
+
+        # key -> {"slot", "language", "entities", "expires_at", "sources", "result"}
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.embeddings = np.zeros((max_size, dim), dtype=np.float32)
+        self.slot_keys: List[Optional[str]] = [None] * max_size
+        self.free_slots = list(range(max_size - 1, -1, -1))
+        self._log_offset = self._log_size()
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidated = 0
+
+    def _log_size(self) -> int:
+        if not self.invalidation_log:
+            return 0
+        try:
+            return os.path.getsize(self.invalidation_log)
+        except OSError:
+            return 0
+
+    def _drop(self, key: str):
+        entry = self.entries.pop(key)
+        self.embeddings[entry["slot"]] = 0
+        self.slot_keys[entry["slot"]] = None
+        self.free_slots.append(entry["slot"])
+
+    def _apply_invalidations(self):
+        """Read invalidation records appended since the last check. Caller holds the lock."""
+        size = self._log_size()
+        if size == self._log_offset:
+            return
+        if size < self._log_offset:
+            # Log was truncated or rotated; we can't tell what changed
+            self._log_offset = 0
+            self.invalidated += len(self.entries)
+            for key in list(self.entries):
+                self._drop(key)
+            return
+
+        changed = set()
+        with open(self.invalidation_log, "r", encoding="utf-8") as f:
+            f.seek(self._log_offset)
+            for line in f:
+                if line.endswith("\n"):
+                    self._log_offset += len(line.encode("utf-8"))
+                    changed.update(json.loads(line)["sources"])
+        stale = [key for key, entry in self.entries.items() if entry["sources"] & changed]
+        for key in stale:
+            self._drop(key)
+        self.invalidated += len(stale)
+        if stale:
+            print(f"Answer cache: invalidated {len(stale)} answers for {len(changed)} changed sources")
+
+    def lookup(self, query: str, language: str,
+               embed: Callable[[], List[float]]) -> Tuple[Optional[Dict[str, Any]], Optional[str], Any]:
+        """
+        Find a cached answer for query in language.
+        Tries the exact normalized query first; only on a miss is embed() called for the
+        semantic comparison. Returns (result, "exact" | "semantic" | None, embedding).
+        """
+        key = normalize_query(query)
+        now = time.monotonic()
+        with self.lock:
+            self._apply_invalidations()
+            entry = self.entries.get(key)
+            if entry is not None and entry["expires_at"] > now:
+                self.entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry["result"], "exact", None
+            if entry is not None:
+                self._drop(key)
+            has_entries = bool(self.entries)
+
+        embedding = embed()
+        if not has_entries:
+            with self.lock:
+                self.misses += 1
+            return None, None, embedding
+
+        query_vector = np.asarray(embedding, dtype=np.float32)
+        entities = query_entities(query)
+        with self.lock:
+            scores = self.embeddings @ query_vector
+            for slot in np.argsort(-scores):
+                if scores[slot] < self.threshold:
+                    break
+                slot_key = self.slot_keys[slot]
+                if slot_key is None:
+                    continue
+                entry = self.entries[slot_key]
+                if (entry["language"] == language and entry["entities"] == entities
+                        and entry["expires_at"] > now):
+                    self.entries.move_to_end(slot_key)
+                    self.semantic_hits += 1
+                    return entry["result"], "semantic", embedding
+            self.misses += 1
+        return None, None, embedding
+
+    def store(self, query: str, language: str, embedding, result: Dict[str, Any]):
+        """
+        Cache a successful result for query along with the sources it was built from.
+        Answers with no sources are skipped: no invalidation could ever reach them.
+        """
+        if self.max_size <= 0 or embedding is None:
+            return
+        key = normalize_query(query)
+        sources = {source.get("source") for source in result.get("sources", []) if source.get("source")}
+        if not sources:
+            return
+        entities = query_entities(query)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            if not self.free_slots:
+                self._drop(next(iter(self.entries)))
+            slot = self.free_slots.pop()
+            self.embeddings[slot] = np.asarray(embedding, dtype=np.float32)
+            self.slot_keys[slot] = key
+            self.entries[key] = {
+                "slot": slot,
+                "language": language,
+                "entities": entities,
+                "expires_at": time.monotonic() + self.ttl,
+                "sources": sources,
+                "result": result,
+            }
+
+    def clear(self):
+        """Drop every cached answer."""
+        with self.lock:
+            for key in list(self.entries):
+                self._drop(key)
+
+    def stats(self) -> dict:
+        """Entry count and hit/miss/invalidation counters."""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_size": self.max_size,
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "invalidated": self.invalidated,
+            }
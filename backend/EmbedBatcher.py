@@ -0,0 +1,124 @@
+import time
+import queue
+import threading
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, List
+
+import numpy as np
+
+# Recent batches kept for the averages in /status
+BATCH_SAMPLES = 1000
+
+
+class EmbeddingBatcher:
+    """
+    Collects texts submitted by concurrent callers and encodes them together.
+
+    A single worker thread takes the first waiting text, then keeps collecting until
+    max_batch_size texts are queued or max_wait_ms has passed since the first one,
+    and runs encode_batch once for the whole batch. Each caller gets its own row
+    back through a Future. Identical texts in a batch are encoded once. A backlog
+    that built up during the previous forward pass is taken without waiting.
+    """
+
+    def __init__(self, encode_batch: Callable[[List[str]], np.ndarray], max_batch_size: int = 16,
+                 max_wait_ms: float = 5.0):
+        self.encode_batch = encode_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.queue: "queue.Queue" = queue.Queue()
+        self.worker = None
+        self.worker_lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+
+        self.batches = 0
+        self.items = 0
+        self.max_batch = 0
+        self.errors = 0
+        self.batch_sizes: Deque[int] = deque(maxlen=BATCH_SAMPLES)
+        self.queue_waits: Deque[float] = deque(maxlen=BATCH_SAMPLES)
+        self.encode_times: Deque[float] = deque(maxlen=BATCH_SAMPLES)
+
+    def _ensure_worker(self):
+        if self.worker is None:
+            with self.worker_lock:
+                if self.worker is None:
+                    self.worker = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+                    self.worker.start()
+
+    def submit(self, text: str) -> Future:
+        """Queue text for the next batch; the Future resolves to its embedding row."""
+        self._ensure_worker()
+        future = Future()
+        self.queue.put((text, future, time.monotonic()))
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        """Embedding of text, encoded in a batch with whatever else arrives alongside it."""
+        return self.submit(text).result()
+
+    def _collect(self) -> list:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            try:
+                # Take anything already queued, then wait out the rest of the window
+                batch.append(self.queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            started = time.monotonic()
+            texts = list(dict.fromkeys(text for text, _, _ in batch))
+            try:
+                embeddings = self.encode_batch(texts)
+            except Exception as e:
+                with self.stats_lock:
+                    self.errors += 1
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            encode_time = time.monotonic() - started
+
+            rows = {text: embeddings[i] for i, text in enumerate(texts)}
+            for text, future, _ in batch:
+                future.set_result(rows[text])
+
+            with self.stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.max_batch = max(self.max_batch, len(batch))
+                self.batch_sizes.append(len(batch))
+                self.queue_waits.extend(started - queued_at for _, _, queued_at in batch)
+                self.encode_times.append(encode_time)
+            print(f"TIMING: Embedding batch of {len(batch)} ({len(texts)} unique) took {encode_time:.4f} seconds")
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            sizes = list(self.batch_sizes)
+            waits = list(self.queue_waits)
+            encodes = list(self.encode_times)
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000,
+                "queued": self.queue.qsize(),
+                "batches": self.batches,
+                "items": self.items,
+                "errors": self.errors,
+                "largest_batch": self.max_batch,
+                "avg_batch_size": round(sum(sizes) / len(sizes), 2) if sizes else 0.0,
+                "avg_wait_ms": round(sum(waits) / len(waits) * 1000, 2) if waits else 0.0,
+                "avg_encode_ms": round(sum(encodes) / len(encodes) * 1000, 2) if encodes else 0.0,
+            }
@@ -0,0 +1,307 @@
+import os
+import json
+import fcntl
+import hashlib
+import threading
+import atexit
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future
+from typing import Any, Callable, List, Optional
+
+import numpy as np
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different copies of a chunk share a key."""
+    return " ".join(text.split())
+
+
+def normalize_query(query: str) -> str:
+    """Case-fold and collapse whitespace so repeated storefront questions share a key."""
+    return normalize_text(query).lower()
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache keyed by (model id, normalized text hash), shared by
+    every process that opens the same directory (API workers and ingest.py).
+
+    Vectors live in a fixed-capacity memory-mapped array file (<name>.vectors) and the
+    SHA-256 key owning each slot in a parallel memory-mapped file (<name>.keys), so
+    all processes see the same slot ownership. A slot is only read back if its stored
+    key still matches, so a slot another process has since reused is a miss, never a
+    wrong vector. Slot allocation and file creation happen under an fcntl lock on
+    <name>.lock. <name>.index.json holds the settings the files were created with.
+
+    Each process keeps its own LRU order for eviction. Writes reach other processes
+    through the shared mapping straight away; flushing them to disk happens on a
+    background thread every flush_interval seconds and at exit, not on the query path.
+    """
+
+    KEY_BYTES = 32
+
+    def __init__(self, cache_dir: str, model_id: str, dim: int,
+                 capacity: int = 100000, dtype: str = "float16", flush_interval: float = 30.0):
+        self.model_id = model_id
+        self.dim = dim
+        self.capacity = capacity
+        self.dtype = np.dtype(dtype)
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self._dirty = 0
+
+        os.makedirs(cache_dir, exist_ok=True)
+        name = model_id.replace("/", "_")
+        self.vectors_path = os.path.join(cache_dir, f"{name}.vectors")
+        self.keys_path = os.path.join(cache_dir, f"{name}.keys")
+        self.index_path = os.path.join(cache_dir, f"{name}.index.json")
+        self.lock_path = os.path.join(cache_dir, f"{name}.lock")
+
+        self.slots: "OrderedDict[str, int]" = OrderedDict()
+        self.free_slots: List[int] = []
+        self._load()
+        self._flusher = threading.Thread(target=self._flush_loop, name="embedding-cache-flush", daemon=True)
+        self._flusher.start()
+        atexit.register(self.flush)
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared with other processes using this cache directory."""
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _header(self) -> dict:
+        return {
+            "model_id": self.model_id,
+            "dim": self.dim,
+            "dtype": self.dtype.name,
+            "capacity": self.capacity,
+        }
+
+    def _files_match(self) -> bool:
+        """Whether the files on disk were created with our settings."""
+        if not (os.path.exists(self.index_path) and os.path.exists(self.vectors_path)
+                and os.path.exists(self.keys_path)):
+            return False
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Warning: Could not read embedding cache index: {e}")
+            return False
+        if any(index.get(key) != value for key, value in self._header().items()):
+            print("Embedding cache settings changed, starting a new cache")
+            return False
+        return (os.path.getsize(self.vectors_path) == self.capacity * self.dim * self.dtype.itemsize and
+                os.path.getsize(self.keys_path) == self.capacity * self.KEY_BYTES)
+
+    def _create_files(self):
+        """
+        Create zeroed files; called under the file lock. Old files are replaced rather
+        than truncated, so a process still mapping them keeps a valid (orphaned) mapping.
+        """
+        for path, size in ((self.vectors_path, self.capacity * self.dim * self.dtype.itemsize),
+                           (self.keys_path, self.capacity * self.KEY_BYTES)):
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.truncate(size)
+            os.replace(tmp_path, path)
+        tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._header(), f)
+        os.replace(tmp_path, self.index_path)
+
+    def _load(self):
+        """Open (or create) the shared files and index the slots already in use."""
+        with self._file_lock():
+            if not self._files_match():
+                self._create_files()
+            self.vectors = np.memmap(self.vectors_path, dtype=self.dtype, mode="r+",
+                                     shape=(self.capacity, self.dim))
+            self.keys = np.memmap(self.keys_path, dtype=np.uint8, mode="r+",
+                                  shape=(self.capacity, self.KEY_BYTES))
+        self._index_slots()
+        print(f"Embedding cache loaded with {len(self.slots)} entries")
+
+    def _index_slots(self):
+        """Rebuild this process's slot map and free list from the shared keys file."""
+        used = np.flatnonzero(self.keys.any(axis=1))
+        self.slots = OrderedDict((bytes(self.keys[slot]).hex(), int(slot)) for slot in used)
+        used_set = set(used.tolist())
+        self.free_slots = [slot for slot in range(self.capacity - 1, -1, -1) if slot not in used_set]
+
+    def key(self, text: str) -> str:
+        """Cache key for text under this cache's model."""
+        payload = f"{self.model_id}\0{normalize_text(text)}"
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, text: str) -> Optional[np.ndarray]:
+        """Return the cached float32 vector for text, or None."""
+        return self.get_many([text])[0]
+
+    def get_many(self, texts: List[str]) -> List[Optional[np.ndarray]]:
+        """Return cached float32 vectors for texts, with None for misses."""
+        keys = [self.key(text) for text in texts]
+        results = []
+        with self.lock:
+            for key in keys:
+                slot = self.slots.get(key)
+                vector = None
+                if slot is not None:
+                    expected = bytes.fromhex(key)
+                    vector = np.array(self.vectors[slot], dtype=np.float32)
+                    # Checked after the read too, in case another process reused the slot meanwhile
+                    if bytes(self.keys[slot]) != expected:
+                        del self.slots[key]
+                        self.stale += 1
+                        vector = None
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                    self.slots.move_to_end(key)
+                results.append(vector)
+        return results
+
+    def put(self, text: str, vector):
+        """Store the vector for text."""
+        self.put_many([text], [vector])
+
+    def _allocate(self) -> int:
+        """A free slot, or this process's least recently used one. Caller holds both locks."""
+        while self.free_slots:
+            slot = self.free_slots.pop()
+            # Another process may have taken it since we last looked
+            if not self.keys[slot].any():
+                return slot
+        if not self.slots:
+            # Every slot we knew about was taken over by other processes; reread the files
+            self._index_slots()
+            if self.free_slots:
+                return self.free_slots.pop()
+        return self.slots.popitem(last=False)[1]
+
+    def put_many(self, texts: List[str], vectors):
+        """Store vectors for texts, evicting least recently used entries when full."""
+        if self.capacity <= 0:
+            return
+        keys = [self.key(text) for text in texts]
+        with self.lock, self._file_lock():
+            for key, vector in zip(keys, vectors):
+                expected = bytes.fromhex(key)
+                slot = self.slots.get(key)
+                if slot is None or bytes(self.keys[slot]) != expected:
+                    slot = self._allocate()
+                # Clear the owner first so readers never match a half-written vector
+                self.keys[slot] = 0
+                self.vectors[slot] = np.asarray(vector, dtype=self.dtype)
+                self.keys[slot] = np.frombuffer(expected, dtype=np.uint8)
+                self.slots[key] = slot
+                self.slots.move_to_end(key)
+                self._dirty += 1
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Warning: Could not flush embedding cache: {e}")
+
+    def flush(self):
+        """Write pending vectors and slot keys to disk."""
+        with self.lock:
+            if not self._dirty:
+                return
+            self.vectors.flush()
+            self.keys.flush()
+            self._dirty = 0
+
+    def stats(self) -> dict:
+        """Entry count and hit/miss counters."""
+        with self.lock:
+            return {
+                "entries": len(self.slots),
+                "capacity": self.capacity,
+                "hits": self.hits,
+                "misses": self.misses,
+                "stale": self.stale,
+            }
+
+
+class QueryEmbeddingCache:
+    """
+    Bounded, thread-safe in-memory LRU cache with a TTL, for query embeddings.
+
+    Concurrent callers asking for the same key while it is being computed wait on
+    the one in-flight computation instead of running the model again.
+    """
+
+    def __init__(self, max_size: int = 1024, ttl: float = 3600):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, value)
+        self.inflight: dict = {}  # key -> Future
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Return the cached value for key, computing it at most once across concurrent callers."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    return entry[1]
+                del self.entries[key]
+
+            future = self.inflight.get(key)
+            owner = future is None
+            if owner:
+                future = self.inflight[key] = Future()
+                self.misses += 1
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            value = compute()
+        except Exception as e:
+            with self.lock:
+                self.inflight.pop(key, None)
+            future.set_exception(e)
+            raise
+
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self.inflight.pop(key, None)
+        future.set_result(value)
+        return value
+
+    def stats(self) -> dict:
+        """Entry count and hit/miss/coalesced counters."""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+            }
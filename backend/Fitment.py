@@ -0,0 +1,105 @@
+import re
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from PartNumbers import normalize_part_number
+
+# Catalog pages encode fitment in the path: /<make>-parts/<year>/<model>.html,
+# e.g. /ford-parts/1999/f53.html or /gm-parts/2012/sierra-3500.html.
+# VectorDB mirrors these patterns in generated SQL columns; keep them in sync.
+FITMENT_MAKE_PATTERN = r"/([a-z0-9-]+)-parts/[0-9]{4}/"
+FITMENT_YEAR_PATTERN = r"-parts/([0-9]{4})/"
+FITMENT_MODEL_PATTERN = r"-parts/[0-9]{4}/([a-z0-9-]+)\.html"
+
+# Brand names customers use, mapped to the make slug in catalog URLs
+MAKE_ALIASES = {
+    "ford": "ford", "lincoln": "ford", "mercury": "ford",
+    "gm": "gm", "chevy": "gm", "chevrolet": "gm", "gmc": "gm", "cadillac": "gm",
+    "buick": "gm", "pontiac": "gm", "oldsmobile": "gm", "saturn": "gm", "hummer": "gm",
+    "chrysler": "chrysler-dodge", "dodge": "chrysler-dodge", "jeep": "chrysler-dodge",
+    "ram": "chrysler-dodge", "plymouth": "chrysler-dodge",
+}
+
+# Aliases that are also ordinary words ("hydraulic ram press"); they only count as a
+# make when the question also names a year or a catalog model
+AMBIGUOUS_MAKE_ALIASES = {"ram"}
+
+YEAR_PATTERN = re.compile(r"\b(19[5-9][0-9]|20[0-9]{2})\b")
+
+
+def fitment_from_url(url: Optional[str]) -> Dict[str, Any]:
+    """Return {"make", "year", "model"} parsed from a catalog URL, or {} for other pages."""
+    if not url:
+        return {}
+    make = re.search(FITMENT_MAKE_PATTERN, url)
+    year = re.search(FITMENT_YEAR_PATTERN, url)
+    model = re.search(FITMENT_MODEL_PATTERN, url)
+    if not (make and year and model):
+        return {}
+    return {"make": make.group(1), "year": int(year.group(1)), "model": model.group(1)}
+
+
+def model_keys(catalog: Iterable[Tuple[str, str]], url: Optional[str] = None) -> FrozenSet[str]:
+    """
+    Part-number keys of catalog model names (sierra-3500 -> SIERRA3500), plus the model of
+    url's catalog page if any, so extract_part_numbers can tell models from part numbers.
+    """
+    keys = {normalize_part_number(model) for _, model in catalog}
+    fitment = fitment_from_url(url)
+    if fitment:
+        keys.add(normalize_part_number(fitment["model"]))
+    return frozenset(keys)
+
+
+def _squash(text: str) -> str:
+    """Lowercase, split on punctuation and join short letter prefixes to numbers (F-150 -> f150)."""
+    text = re.sub(r"[^a-z0-9]+", " ", text.lower())
+    text = re.sub(r"\b([a-z]{1,2}) (?=[0-9])", r"\1", text)
+    return f" {text.strip()} "
+
+
+def _model_family(model: str) -> str:
+    """Leading words of a model slug before any trim number: sierra-3500 -> sierra."""
+    words = _squash(model).split()
+    family = []
+    for word in words:
+        if family and any(ch.isdigit() for ch in word):
+            break
+        family.append(word)
+    return f" {' '.join(family)} "
+
+
+def parse_fitment_query(query: str, catalog: Iterable[Tuple[str, str]]) -> Optional[Dict[str, List]]:
+    """
+    Find vehicle fitment in a question, matched against catalog (make, model) pairs.
+
+    Returns {"makes": [...], "years": [...], "models": [...]} with empty lists for
+    entities not mentioned, or None unless a known model or a make together with a
+    year is mentioned: a make alone ("return policy for ford parts") or a bare year is
+    too broad to filter on. Models match on the full name ("sierra 3500") or, failing
+    that, on the model family ("sierra").
+    """
+    text = _squash(query)
+    aliases = {word for word in MAKE_ALIASES if f" {word} " in text}
+    makes = sorted({MAKE_ALIASES[word] for word in aliases})
+    years = sorted({int(year) for year in YEAR_PATTERN.findall(query)})
+
+    catalog = [(make, model) for make, model in catalog if not makes or make in makes]
+    models = sorted({model for _, model in catalog if _squash(model) in text})
+    if not models:
+        models = sorted({model for _, model in catalog if _model_family(model) in text})
+
+    if not years and not models and aliases & AMBIGUOUS_MAKE_ALIASES:
+        makes = sorted({MAKE_ALIASES[word] for word in aliases - AMBIGUOUS_MAKE_ALIASES})
+
+    if not models and not (makes and years):
+        return None
+    return {"makes": makes, "years": years, "models": models}
+
+
+def matches_fitment(fitment: Dict[str, Any], wanted: Dict[str, List]) -> bool:
+    """True if a row's fitment (from fitment_from_url) satisfies a parse_fitment_query filter."""
+    if not fitment:
+        return False
+    return ((not wanted["makes"] or fitment["make"] in wanted["makes"]) and
+            (not wanted["years"] or fitment["year"] in wanted["years"]) and
+            (not wanted["models"] or fitment["model"] in wanted["models"]))
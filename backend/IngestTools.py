@@ -0,0 +1,454 @@
+import os
+import re
+import sys
+import csv
+import json
+import glob
+import queue
+import time
+import datetime
+import traceback
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Dict, Any, Tuple
+from langchain_docling.loader import ExportType
+from langchain_docling import DoclingLoader
+from docling.chunking import HybridChunker
+from docling.document_converter import DocumentConverter
+from VectorTools import SCRIPT_DIR, EMBED_MODEL_ID, EMBED_BATCH_SIZE, get_embeddings
+from AnswerCache import publish_invalidation
+
+# The scraper lives at the repository root; use its filename scheme so URL lookups
+# always match the files it saved
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+from webscrape import url_to_filename
+
+# Document conversion and the streaming ingest pipeline. Kept apart from VectorTools
+# so the query service never imports Docling or builds the chunker tokenizer.
+
+DOC_LOAD_DIR = os.path.join(SCRIPT_DIR, "TempDocumentStore")
+CSV_FILE = os.path.join(SCRIPT_DIR, "discovered_links.csv")
+EXPORT_TYPE = ExportType.DOC_CHUNKS
+
+# Number of processes used for Docling conversion
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", os.cpu_count() or 1))
+
+# Files buffered between streaming ingest stages
+INGEST_QUEUE_SIZE = int(os.environ.get("INGEST_QUEUE_SIZE", 4))
+
+def get_chunker() -> HybridChunker:
+    """Create the chunker (and its tokenizer) for document processing once per process."""
+    if not hasattr(get_chunker, "chunker"):
+        get_chunker.chunker = HybridChunker(
+            tokenizer=EMBED_MODEL_ID,
+            max_tokens=2000,
+            overlap_tokens=100,
+            split_by_paragraph=True,
+            min_tokens=50
+        )
+    return get_chunker.chunker
+
+# Docling converter of this process; its layout and table models load on first use
+# and are reused for every file the process converts
+_converter = None
+
+def get_converter() -> DocumentConverter:
+    """Create the Docling converter once per process."""
+    global _converter
+    if _converter is None:
+        _converter = DocumentConverter()
+    return _converter
+
+class UrlIndex:
+    """
+    In-memory map from scraped filename to page URL built from discovered_links.csv.
+    The CSV is only re-read when its modification time or size changes.
+    """
+    def __init__(self, csv_file: str):
+        self.csv_file = csv_file
+        self.urls: Dict[str, str] = {}
+        self._signature = None
+
+    def refresh(self):
+        """Reload the index if the CSV changed since the last load."""
+        try:
+            stat = os.stat(self.csv_file)
+        except OSError:
+            self.urls, self._signature = {}, None
+            return
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+
+        urls = {}
+        with open(self.csv_file, newline='', encoding='utf-8') as f:
+            reader = csv.reader(f)
+            next(reader, None)  # header row
+            for row in reader:
+                if row and row[0]:
+                    urls[url_to_filename(row[0])] = row[0]
+        self.urls, self._signature = urls, signature
+        print(f"Loaded {len(urls)} urls from {Path(self.csv_file).name}")
+
+    def lookup(self, document_name: str):
+        """Return the URL for a document path or filename, or None."""
+        self.refresh()
+        # Sources may be Windows or POSIX paths; only the filename is the key
+        return self.urls.get(re.split(r'[\\/]', document_name)[-1])
+
+def get_url_index(csv_file: str = CSV_FILE) -> UrlIndex:
+    """Return the process-wide UrlIndex for csv_file."""
+    if not hasattr(get_url_index, "indexes"):
+        get_url_index.indexes = {}
+    if csv_file not in get_url_index.indexes:
+        get_url_index.indexes[csv_file] = UrlIndex(csv_file)
+    return get_url_index.indexes[csv_file]
+
+def find_url(csv_file, document_name):
+    """
+    Search for a document name in a CSV file and return the corresponding URL.
+    
+    Parameters:
+    csv_file (str): Path to the CSV file.
+    document_name (str): The name or path of the document to search for.
+    
+    Returns:
+    str: The corresponding URL if found, otherwise None.
+    """
+    try:
+        return get_url_index(csv_file).lookup(document_name)
+    except Exception as e:
+        print(f"Error: {e}")
+        return None
+
+def _init_convert_worker():
+    """Pool initializer: build the chunker and converter once per worker instead of once per file."""
+    get_chunker()
+    get_converter()
+
+def convert_file(file: str, file_type: str, category: str) -> List:
+    """
+    Convert and chunk a single file with Docling and return its document chunks.
+    Runs inside a conversion worker process.
+    """
+    print(f"Loading {file_type}: {Path(file).name}")
+    loader = DoclingLoader(
+        file_path=[file],
+        converter=get_converter(),
+        export_type=EXPORT_TYPE,
+        chunker=get_chunker(),
+    )
+    docs = loader.load()
+
+    for doc in docs:
+        # Extract and clean metadata
+        source_file = None
+        headings = None
+        url = None
+        timestamp = datetime.datetime.now().isoformat()
+        
+        if hasattr(doc, 'metadata') and doc.metadata:
+            if 'source' in doc.metadata:
+                source_file = doc.metadata['source']
+            
+            if 'dl_meta' in doc.metadata and 'headings' in doc.metadata['dl_meta']:
+                headings = doc.metadata['dl_meta']['headings'][0] if doc.metadata['dl_meta']['headings'] else None
+        
+            # Clean up the source file path
+            source_file = source_file.replace("discovered_links.csv","")
+            url = find_url(CSV_FILE, source_file)
+
+        # Replace the metadata with simplified version
+        doc.metadata = {
+            'source': source_file,
+            'heading': headings,
+            'scraped_at': timestamp,
+            "url": url,
+            "type": category
+        }
+
+    return docs
+
+def iter_converted_files(jobs: List[Tuple[str, str]], category: str, workers: int = INGEST_WORKERS):
+    """
+    Convert (file, file_type) jobs across a process pool and yield (file, chunks) pairs.
+    Results come back in job order regardless of which worker finishes first, and at most
+    two jobs per worker are in flight so memory stays bounded. A file that fails to convert
+    is reported and yielded with chunks=None without aborting the batch.
+    """
+    workers = max(1, min(workers, len(jobs)))
+
+    if workers == 1:
+        _init_convert_worker()
+        for file, file_type in jobs:
+            try:
+                docs = convert_file(file, file_type, category)
+            except Exception as e:
+                print(f"Error converting {Path(file).name}: {e}")
+                docs = None
+            yield file, docs
+        return
+
+    print(f"Converting {len(jobs)} files with {workers} worker processes")
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_convert_worker) as executor:
+        job_iter = iter(jobs)
+        pending = deque()
+        for file, file_type in job_iter:
+            pending.append((file, executor.submit(convert_file, file, file_type, category)))
+            if len(pending) >= workers * 2:
+                break
+
+        while pending:
+            file, future = pending.popleft()
+            try:
+                docs = future.result()
+            except Exception as e:
+                print(f"Error converting {Path(file).name}: {e}")
+                print(traceback.format_exc())
+                docs = None
+
+            next_job = next(job_iter, None)
+            if next_job is not None:
+                pending.append((next_job[0], executor.submit(convert_file, next_job[0], next_job[1], category)))
+            yield file, docs
+
+def process_files(jobs: List[Tuple[str, str]], category: str, workers: int = INGEST_WORKERS) -> List:
+    """
+    Convert (file, file_type) jobs across a process pool and return all of their chunks
+    in job order. Files that fail to convert are reported and skipped.
+    """
+    all_splits = []
+    failures = []
+    for file, docs in iter_converted_files(jobs, category, workers):
+        if docs is None:
+            failures.append(file)
+        else:
+            all_splits.extend(docs)
+
+    if failures:
+        print(f"Failed to convert {len(failures)} of {len(jobs)} files: "
+              f"{', '.join(Path(f).name for f in failures)}")
+    return all_splits
+
+def list_document_jobs(urlpath) -> List[Tuple[str, str]]:
+    """Return the (file, file_type) pairs to ingest from urlpath in a stable order."""
+    # Define file types and their extensions
+    file_types = {
+        'PDF': sorted(glob.glob(os.path.join(urlpath, "*.pdf"))),
+        'Markdown': sorted(glob.glob(os.path.join(urlpath, "*.md"))),
+        'DOCX': sorted(glob.glob(os.path.join(urlpath, "*.docx"))),
+        'CSV': sorted(glob.glob(os.path.join(urlpath, "*.csv"))),
+        'text': sorted(glob.glob(os.path.join(urlpath, "*.txt"))),
+        'HTML': sorted(glob.glob(os.path.join(urlpath, "*.html"))),
+    }
+
+    print(f"Processing {len(file_types['PDF'])} PDFs, {len(file_types['Markdown'])} Markdown, "
+          f"{len(file_types['DOCX'])} DOCX, {len(file_types['CSV'])} CSV files, "
+          f"{len(file_types['text'])} Text, and {len(file_types['HTML'])} HTML"
+          )
+
+    # PDFs first since they take the longest
+    return [(file, file_type) for file_type, files in file_types.items() for file in files]
+
+def process_documents(urlpath, category, workers: int = INGEST_WORKERS):
+    """Process and ingest documents into PGvectorstore"""
+    print("Starting document ingestion process...")
+    jobs = list_document_jobs(urlpath)
+
+    # Load the url index once up front so forked workers inherit it
+    get_url_index().refresh()
+
+    all_splits = process_files(jobs, category, workers) if jobs else []
+    
+    print(f"Total document chunks created: {len(all_splits)}")
+    return all_splits
+
+class IngestCheckpoint:
+    """
+    JSON record of the files an ingest run has already written, so a restarted
+    run over the same directory and category can skip them.
+    """
+    def __init__(self, path: str, urlpath: str, category: str):
+        self.path = path
+        self.header = {
+            "urlpath": os.path.abspath(urlpath),
+            "category": category,
+            "model_id": EMBED_MODEL_ID,
+        }
+        self.done: Dict[str, List[int]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                if all(data.get(key) == value for key, value in self.header.items()):
+                    self.done = data.get("done", {})
+                    print(f"Resuming ingest: {len(self.done)} files already written")
+                else:
+                    print("Checkpoint is for a different ingest, starting over")
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not read checkpoint {path}: {e}")
+
+    @staticmethod
+    def _signature(file: str) -> List[int]:
+        stat = os.stat(file)
+        return [stat.st_mtime_ns, stat.st_size]
+
+    def is_done(self, file: str) -> bool:
+        """True if file was written by a previous run and hasn't changed since."""
+        return self.done.get(file) == self._signature(file)
+
+    def mark_done(self, file: str):
+        """Record file as written and save the checkpoint atomically."""
+        self.done[file] = self._signature(file)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(dict(self.header, done=self.done), f)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """Remove the checkpoint once a run has completed."""
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+_STAGE_DONE = object()
+
+def _put_until_stopped(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Put item on a bounded queue, giving up if the pipeline is stopping."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.5)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+def _get_until_stopped(q: queue.Queue, stop: threading.Event):
+    """Get the next item from a queue, returning _STAGE_DONE if the pipeline is stopping."""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.5)
+        except queue.Empty:
+            continue
+    return _STAGE_DONE
+
+def ingest_directory(vector_db, urlpath, category, checkpoint_path: str = None,
+                     workers: int = INGEST_WORKERS, batch_size: int = EMBED_BATCH_SIZE,
+                     queue_size: int = INGEST_QUEUE_SIZE) -> Dict[str, Any]:
+    """
+    Stream the documents in urlpath into vector_db one file at a time.
+
+    Three stages run concurrently with bounded queues between them:
+    convert (Docling across a process pool) -> plan + embed (new chunks only) -> write.
+    Each file is written and committed in its own transaction, its changed sources are
+    published to the answer cache invalidation log, and when checkpoint_path is given the
+    file is then recorded so an interrupted run resumes after it.
+    Returns counts of files, failed files and inserted/deleted/unchanged chunks, plus
+    the list of changed_sources whose stored chunks were added to or removed.
+    """
+    print("Starting streaming document ingestion...")
+    start_time = time.time()
+    jobs = list_document_jobs(urlpath)
+    checkpoint = IngestCheckpoint(checkpoint_path, urlpath, category) if checkpoint_path else None
+    if checkpoint is not None:
+        jobs = [job for job in jobs if not checkpoint.is_done(job[0])]
+
+    stats = {"files": 0, "failed": 0, "inserted": 0, "deleted": 0, "unchanged": 0, "changed_sources": []}
+    if not jobs:
+        print("Nothing to ingest")
+        return stats
+
+    # Load the url index once up front so forked workers inherit it
+    get_url_index().refresh()
+
+    converted = queue.Queue(maxsize=queue_size)
+    embedded = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    errors = []
+
+    def convert_stage():
+        try:
+            for item in iter_converted_files(jobs, category, workers):
+                if not _put_until_stopped(converted, item, stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put_until_stopped(converted, _STAGE_DONE, stop)
+
+    def embed_stage():
+        try:
+            while True:
+                item = _get_until_stopped(converted, stop)
+                if item is _STAGE_DONE:
+                    break
+                file, docs = item
+                if docs is None:
+                    _put_until_stopped(embedded, (file, None, None), stop)
+                    continue
+
+                plans = vector_db.plan_sync(docs)
+                new_docs = [doc for plan in plans for doc, _ in plan["new"]]
+                embeddings = get_embeddings(new_docs, batch_size=batch_size) if new_docs else None
+                if not _put_until_stopped(embedded, (file, plans, embeddings), stop):
+                    return
+        except Exception as e:
+            errors.append(e)
+        finally:
+            _put_until_stopped(embedded, _STAGE_DONE, stop)
+
+    stages = [
+        threading.Thread(target=convert_stage, name="ingest-convert", daemon=True),
+        threading.Thread(target=embed_stage, name="ingest-embed", daemon=True),
+    ]
+    for stage in stages:
+        stage.start()
+
+    # Write stage runs on the caller's thread and owns vector_db.conn
+    try:
+        while True:
+            item = embedded.get()
+            if item is _STAGE_DONE:
+                break
+            file, plans, embeddings = item
+            if plans is None:
+                stats["failed"] += 1
+                continue
+
+            file_stats = vector_db.apply_sync(plans, embeddings)
+            for key, value in file_stats.items():
+                stats[key] += value
+            changed_sources = [
+                plan["source"] for plan in plans
+                if plan["new"] or plan["has_stale"] or plan["model_changed"]
+            ]
+            # Invalidate as soon as the file is committed: if a later file fails, the
+            # resumed run skips this one and would never report it changed
+            publish_invalidation(changed_sources)
+            stats["changed_sources"].extend(changed_sources)
+            stats["files"] += 1
+            if checkpoint is not None:
+                checkpoint.mark_done(file)
+            print(f"Wrote {Path(file).name} ({stats['files'] + stats['failed']}/{len(jobs)} files): "
+                  f"{file_stats['inserted']} inserted, {file_stats['deleted']} deleted, "
+                  f"{file_stats['unchanged']} unchanged")
+    finally:
+        stop.set()
+        for stage in stages:
+            stage.join()
+
+    if errors:
+        raise errors[0]
+    if checkpoint is not None and stats["failed"] == 0:
+        checkpoint.clear()
+
+    # Build the ANN index now that the table has data to train/link against
+    vector_db.ensure_vector_index()
+
+    end_time = time.time()
+    print(f"Ingest complete: {stats['files']} files ({stats['failed']} failed), "
+          f"{stats['inserted']} inserted, {stats['deleted']} deleted, {stats['unchanged']} unchanged, "
+          f"{len(stats['changed_sources'])} sources changed")
+    print(f"TIMING: ingest_directory took {end_time - start_time:.4f} seconds")
+    return stats
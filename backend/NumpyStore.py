@@ -0,0 +1,555 @@
+import os
+import glob
+import json
+import time
+import fcntl
+import threading
+import difflib
+from contextlib import contextmanager
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from VectorStore import VectorStore, group_chunks_by_source, content_hash
+from Fitment import fitment_from_url, parse_fitment_query, matches_fitment, model_keys
+from PartNumbers import extract_part_numbers
+
+# Rows scored per matmul when assigning vectors to IVF lists, to bound temporary memory
+ASSIGN_BLOCK_ROWS = 65536
+
+# Write batches kept in the append-only log before it is folded into a new base generation
+COMPACT_LOG_ENTRIES = 64
+
+# Bump when part number extraction changes so stored part_keys are recomputed on load
+PART_KEYS_VERSION = 2
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """L2-normalize rows so dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Embedded vector store for deployments without PostgreSQL.
+
+    Normalized embeddings live in a memory-mapped float32 matrix and chunk text, metadata
+    and the per-source manifest in a JSON sidecar (documents.json) naming the matrix and
+    IVF files of its generation. Search is an exact matmul over the matrix, or once
+    build_ivf_index() has run, a matmul over the rows of the nprobe closest k-means lists.
+
+    Writes don't rewrite the base files: each batch saves its new vectors as a chunk file
+    and appends one line (new records, deleted ids, manifest changes) to log.jsonl. Every
+    COMPACT_LOG_ENTRIES batches the log is folded into a new base generation. Writers
+    serialize on a lock file, and refresh() (run before each search) replays entries
+    other processes appended, or reloads after a compaction.
+    """
+
+    def __init__(self, store_dir: str, model_id: str, dim: int,
+                 index_type: str = "exact", nprobe: int = 8, ivf_min_rows: int = 5000,
+                 fitment_filter: bool = True):
+        start_time = time.time()
+        self.store_dir = store_dir
+        self.model_id = model_id
+        self.dim = dim
+        self.index_type = index_type
+        self.nprobe = nprobe
+        self.ivf_min_rows = ivf_min_rows
+        self.fitment_filter = fitment_filter
+        self.lock = threading.RLock()
+
+        self.documents_path = os.path.join(store_dir, "documents.json")
+        self.log_path = os.path.join(store_dir, "log.jsonl")
+        self.chunks_dir = os.path.join(store_dir, "chunks")
+        self.lock_path = os.path.join(store_dir, "store.lock")
+        os.makedirs(self.chunks_dir, exist_ok=True)
+
+        self.source_rows: Dict[str, List[int]] = {}
+        self.fitment: List[Dict[str, Any]] = []
+        self.fitment_catalog = []
+        self.part_rows: Dict[str, List[int]] = {}
+        self.lists = None
+        self._load()
+        end_time = time.time()
+        print(f"TIMING: NumpyVectorStore initialization took {end_time - start_time:.4f} seconds")
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock shared with other processes writing to this store directory."""
+        with open(self.lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _reset(self):
+        self.vectors = np.zeros((0, self.dim), dtype=np.float32)
+        self.records: List[Dict[str, Any]] = []
+        self.manifest: Dict[str, Dict[str, Any]] = {}
+        self.next_id = 1
+        self.centroids = None
+        self.assignments = None
+        self.log_seq = 0       # last log entry applied
+        self.log_offset = 0    # bytes of log.jsonl consumed
+        self.log_entries = 0   # entries applied since the base generation
+        self.base_version = None
+
+    def _base_version(self, stat: os.stat_result = None):
+        """Identity of the current documents.json, which changes with every compaction."""
+        if stat is None:
+            try:
+                stat = os.stat(self.documents_path)
+            except FileNotFoundError:
+                return None
+        return stat.st_ino, stat.st_mtime_ns
+
+    def _load(self, attempts: int = 3):
+        """Memory-map the base generation, read its sidecar and replay the write log."""
+        for attempt in range(attempts):
+            try:
+                self._load_base()
+                self._replay_log()
+                break
+            except FileNotFoundError:
+                # A compaction removed the files of the generation being read; start over
+                if attempt == attempts - 1:
+                    raise
+        self._reindex()
+        print(f"Loaded {len(self.records)} documents from {self.store_dir}")
+
+    def _load_base(self):
+        self._reset()
+        try:
+            f = open(self.documents_path, "r", encoding="utf-8")
+        except FileNotFoundError:
+            return
+        with f:
+            self.base_version = self._base_version(os.fstat(f.fileno()))
+            data = json.load(f)
+        self.records = data["records"]
+        self.manifest = data.get("manifest", {})
+        self.next_id = data.get("next_id", len(self.records) + 1)
+        self.log_seq = data.get("log_seq", 0)
+        if data.get("part_keys_version") != PART_KEYS_VERSION:
+            for record in self.records:
+                record.pop("part_keys", None)
+        self.vectors = np.load(os.path.join(self.store_dir, data.get("vectors_file", "vectors.npy")),
+                               mmap_mode="r")
+        ivf_file = data.get("ivf_file", "ivf.npz")
+        if ivf_file and os.path.exists(os.path.join(self.store_dir, ivf_file)):
+            ivf = np.load(os.path.join(self.store_dir, ivf_file))
+            self.centroids, self.assignments = ivf["centroids"], ivf["assignments"]
+
+    def _replay_log(self) -> Optional[int]:
+        """
+        Apply log entries appended since the last read. Returns how many were applied, or
+        None when the log no longer lines up with this instance (after a compaction).
+        """
+        try:
+            f = open(self.log_path, "rb")
+        except FileNotFoundError:
+            return 0 if self.log_offset == 0 else None
+        with f:
+            if os.fstat(f.fileno()).st_size < self.log_offset:
+                return None
+            f.seek(self.log_offset)
+            data = f.read()
+        # A writer may be mid-append; leave an unterminated last line for the next read
+        end = data.rfind(b"\n") + 1
+        applied = 0
+        for line in data[:end].splitlines():
+            entry = json.loads(line)
+            if entry["seq"] <= self.log_seq:
+                continue
+            if entry["seq"] != self.log_seq + 1:
+                return None
+            vectors = np.zeros((0, self.dim), dtype=np.float32)
+            if entry["records"]:
+                vectors = np.load(self._chunk_path(entry["seq"]))
+            self._apply(entry, vectors)
+            applied += 1
+        self.log_offset += end
+        return applied
+
+    def refresh(self):
+        """Pick up writes made through other instances: replay new log entries, or reload the store."""
+        with self.lock:
+            if self._base_version() == self.base_version:
+                try:
+                    log_size = os.path.getsize(self.log_path)
+                except FileNotFoundError:
+                    log_size = 0
+                if log_size == self.log_offset:
+                    return
+                try:
+                    applied = self._replay_log()
+                except FileNotFoundError:
+                    applied = None
+                if applied is not None:
+                    if applied:
+                        self._reindex()
+                    return
+            self._load()
+
+    def _chunk_path(self, seq: int) -> str:
+        return os.path.join(self.chunks_dir, f"{seq}.npy")
+
+    def _reindex(self):
+        """Rebuild the in-memory lookups derived from records and IVF assignments."""
+        self.source_rows = {}
+        for row, record in enumerate(self.records):
+            self.source_rows.setdefault(record["metadata"].get("source") or "", []).append(row)
+        self.fitment = [fitment_from_url(record["metadata"].get("url")) for record in self.records]
+        self.fitment_catalog = sorted({(f["make"], f["model"]) for f in self.fitment if f})
+        self.part_rows = {}
+        for row, record in enumerate(self.records):
+            if "part_keys" not in record:
+                record["part_keys"] = self._part_keys(record["content"], record["metadata"])
+            for key in record["part_keys"]:
+                self.part_rows.setdefault(key, []).append(row)
+        self.lists = None
+        if self.centroids is not None:
+            order = np.argsort(self.assignments, kind="stable")
+            bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+            self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    def _save(self):
+        """
+        Fold the current state into a new base generation and clear the log. The sidecar
+        is replaced last and names its own matrix and IVF files, so a reader never pairs
+        it with another generation's files. Call with the file lock held.
+        """
+        generation = time.time_ns()
+        vectors_file = f"vectors-{generation}.npy"
+        np.save(os.path.join(self.store_dir, vectors_file), np.ascontiguousarray(self.vectors, dtype=np.float32))
+        ivf_file = None
+        if self.centroids is not None:
+            ivf_file = f"ivf-{generation}.npz"
+            np.savez(os.path.join(self.store_dir, ivf_file), centroids=self.centroids, assignments=self.assignments)
+
+        tmp_documents = self.documents_path + ".tmp"
+        with open(tmp_documents, "w", encoding="utf-8") as f:
+            json.dump({
+                "model_id": self.model_id,
+                "dim": self.dim,
+                "next_id": self.next_id,
+                "log_seq": self.log_seq,
+                "part_keys_version": PART_KEYS_VERSION,
+                "vectors_file": vectors_file,
+                "ivf_file": ivf_file,
+                "manifest": self.manifest,
+                "records": self.records,
+            }, f)
+        os.replace(tmp_documents, self.documents_path)
+        self.base_version = self._base_version()
+
+        # The log and the previous generation are now redundant
+        open(self.log_path, "wb").close()
+        self.log_offset = 0
+        self.log_entries = 0
+        for path in glob.glob(os.path.join(self.chunks_dir, "*.npy")):
+            os.remove(path)
+        for path in glob.glob(os.path.join(self.store_dir, "vectors*.npy")) + \
+                glob.glob(os.path.join(self.store_dir, "ivf*.npz")):
+            if os.path.basename(path) not in (vectors_file, ivf_file):
+                os.remove(path)
+
+        self.vectors = np.load(os.path.join(self.store_dir, vectors_file), mmap_mode="r")
+
+    def _part_keys(self, content: str, metadata: Dict) -> List[str]:
+        """Normalized part numbers mentioned in a chunk or its heading, skipping catalog model names."""
+        exclude = model_keys(self.fitment_catalog, metadata.get("url"))
+        return [key for key, _ in extract_part_numbers(f"{metadata.get('heading') or ''}\n{content}",
+                                                       exclude=exclude)]
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        """Nearest IVF list for each row."""
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for start in range(0, len(vectors), ASSIGN_BLOCK_ROWS):
+            block = vectors[start:start + ASSIGN_BLOCK_ROWS]
+            assignments[start:start + len(block)] = np.argmax(block @ self.centroids.T, axis=1)
+        return assignments
+
+    def _apply(self, entry: Dict[str, Any], new_vectors: np.ndarray):
+        """Apply one log entry (deleted ids, new records and their vectors, manifest changes)."""
+        deleted = set(entry["deleted_ids"])
+        keep = np.array([record["id"] not in deleted for record in self.records], dtype=bool)
+        if deleted:
+            self.records = [record for record, kept in zip(self.records, keep) if kept]
+            self.vectors = np.asarray(self.vectors)[keep]
+            if self.centroids is not None:
+                self.assignments = self.assignments[keep]
+        if entry["records"]:
+            self.records = self.records + entry["records"]
+            self.vectors = np.concatenate([self.vectors, new_vectors])
+            if self.centroids is not None:
+                self.assignments = np.concatenate([self.assignments, self._assign(new_vectors)])
+        for source, manifest_entry in entry["manifest"].items():
+            if manifest_entry is None:
+                self.manifest.pop(source, None)
+            else:
+                self.manifest[source] = manifest_entry
+        self.next_id = entry["next_id"]
+        self.log_seq = entry["seq"]
+        self.log_entries += 1
+
+    def _write(self, keep: np.ndarray, documents: List[str], metadatas: List[Dict], embeddings,
+               manifest: Dict[str, Optional[Dict[str, Any]]] = None):
+        """
+        Drop the rows where keep is False, append new rows and apply the manifest changes
+        (None removes a source), persisted as one log entry. Call with the file lock held,
+        after refresh(), with keep built from the current rows.
+        """
+        new_vectors = _normalize(np.asarray(embeddings, dtype=np.float32).reshape(-1, self.dim))
+        records = []
+        next_id = self.next_id
+        for doc, metadata in zip(documents, metadatas):
+            records.append({
+                "id": next_id,
+                "content": doc,
+                "metadata": metadata,
+                "content_hash": content_hash(doc),
+                "part_keys": self._part_keys(doc, metadata),
+            })
+            next_id += 1
+        entry = {
+            "seq": self.log_seq + 1,
+            "next_id": next_id,
+            "deleted_ids": [record["id"] for record, kept in zip(self.records, keep) if not kept],
+            "records": records,
+            "manifest": manifest or {},
+        }
+
+        # The chunk file goes first so the entry never points at a missing file
+        if records:
+            tmp_chunk = self._chunk_path(entry["seq"]) + ".tmp.npy"
+            np.save(tmp_chunk, new_vectors)
+            os.replace(tmp_chunk, self._chunk_path(entry["seq"]))
+        with open(self.log_path, "ab") as f:
+            f.write(json.dumps(entry).encode("utf-8") + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+            self.log_offset = f.tell()
+
+        self._apply(entry, new_vectors)
+        if self.log_entries >= COMPACT_LOG_ENTRIES:
+            self._save()
+        self._reindex()
+
+    def add_documents(self, documents: List[str], metadatas: List[Dict] = None, batch_size: int = None, **kwargs):
+        """Embed and append documents."""
+        from VectorTools import get_embeddings, EMBED_BATCH_SIZE
+        if metadatas is None:
+            metadatas = [{}] * len(documents)
+        embeddings = get_embeddings(documents, batch_size=batch_size or EMBED_BATCH_SIZE)
+        with self.lock, self._file_lock():
+            self.refresh()
+            self._write(np.ones(len(self.records), dtype=bool), documents, metadatas, embeddings)
+
+    def sync_documents(self, documents: List[str], metadatas: List[Dict] = None,
+                       batch_size: int = None, **kwargs) -> Dict[str, int]:
+        """Store only new or changed chunks per source and drop stale ones."""
+        from VectorTools import get_embeddings, EMBED_BATCH_SIZE
+        if metadatas is None:
+            metadatas = [{}] * len(documents)
+        plans = self.plan_sync(zip(documents, metadatas))
+        new_docs = [doc for plan in plans for doc, _ in plan["new"]]
+        embeddings = get_embeddings(new_docs, batch_size=batch_size or EMBED_BATCH_SIZE) if new_docs else None
+        stats = self.apply_sync(plans, embeddings)
+        print(f"Sync complete: {stats['inserted']} inserted, {stats['deleted']} deleted, "
+              f"{stats['unchanged']} unchanged across {len(plans)} sources")
+        return stats
+
+    def plan_sync(self, docs) -> List[Dict[str, Any]]:
+        """Work out, per source, which chunks are new compared to what is stored."""
+        by_source = group_chunks_by_source(docs)
+        plans = []
+        with self.lock:
+            for source, chunks in by_source.items():
+                entry = self.manifest.get(source)
+                model_changed = entry is not None and entry.get("model_id") != self.model_id
+                stored = set()
+                if not model_changed:
+                    stored = {self.records[row]["content_hash"] for row in self.source_rows.get(source, [])}
+                plans.append({
+                    "source": source,
+                    "hashes": list(chunks),
+                    "url": next((m.get("url") for _, m in chunks.values() if m.get("url")), None),
+                    "model_changed": model_changed,
+                    "has_stale": bool(stored - set(chunks)),
+                    "new": [pair for chunk_hash, pair in chunks.items() if chunk_hash not in stored],
+                    "unchanged": sum(1 for chunk_hash in chunks if chunk_hash in stored),
+                })
+        return plans
+
+    def apply_sync(self, plans: List[Dict[str, Any]], embeddings) -> Dict[str, int]:
+        """Drop stale and duplicate rows for each planned source and append the new chunks."""
+        stats = {"inserted": 0, "deleted": 0, "unchanged": 0}
+        new_docs, new_metas = [], []
+        manifest = {}
+        with self.lock, self._file_lock():
+            self.refresh()
+            keep = np.ones(len(self.records), dtype=bool)
+            for plan in plans:
+                wanted = set(plan["hashes"])
+                seen = set()
+                for row in self.source_rows.get(plan["source"], []):
+                    chunk_hash = self.records[row]["content_hash"]
+                    if plan["model_changed"] or chunk_hash not in wanted or chunk_hash in seen:
+                        keep[row] = False
+                    seen.add(chunk_hash)
+                stats["unchanged"] += plan["unchanged"]
+                for doc, metadata in plan["new"]:
+                    new_docs.append(doc)
+                    new_metas.append(metadata)
+                manifest[plan["source"]] = {
+                    "url": plan["url"],
+                    "chunk_hashes": plan["hashes"],
+                    "model_id": self.model_id,
+                }
+            stats["deleted"] = int((~keep).sum())
+            stats["inserted"] = len(new_docs)
+            self._write(keep, new_docs, new_metas, embeddings if new_docs else np.zeros((0, self.dim)), manifest)
+        return stats
+
+    def delete_documents(self, source: str) -> int:
+        """Delete every chunk of a source and its manifest entry."""
+        with self.lock, self._file_lock():
+            self.refresh()
+            keep = np.ones(len(self.records), dtype=bool)
+            keep[self.source_rows.get(source, [])] = False
+            deleted = int((~keep).sum())
+            self._write(keep, [], [], np.zeros((0, self.dim)), {source: None})
+        return deleted
+
+    def build_ivf_index(self, nlist: int = None, iterations: int = 10, seed: int = 0):
+        """Cluster the matrix into nlist lists with spherical k-means (default sqrt(rows))."""
+        start_time = time.time()
+        with self.lock, self._file_lock():
+            self.refresh()
+            vectors = np.asarray(self.vectors)
+            if len(vectors) == 0:
+                return
+            nlist = min(len(vectors), nlist or max(1, int(np.sqrt(len(vectors)))))
+            rng = np.random.default_rng(seed)
+            self.centroids = vectors[rng.choice(len(vectors), nlist, replace=False)].copy()
+            for _ in range(iterations):
+                self.assignments = self._assign(vectors)
+                sums = np.zeros_like(self.centroids)
+                np.add.at(sums, self.assignments, vectors)
+                empty = ~sums.any(axis=1)
+                sums[empty] = self.centroids[empty]
+                self.centroids = _normalize(sums)
+            self.assignments = self._assign(vectors)
+            self._save()
+            self._reindex()
+        end_time = time.time()
+        print(f"TIMING: build_ivf_index built {nlist} lists in {end_time - start_time:.4f} seconds")
+
+    def ensure_vector_index(self):
+        """Build the IVF lists after a bulk load when configured and the store is large enough."""
+        if self.index_type == "ivf" and self.centroids is None and len(self.records) >= self.ivf_min_rows:
+            self.build_ivf_index()
+
+    def search_vector(self, query_embedding, limit: int, nprobe: int = None,
+                      fitment: Dict[str, List] = None) -> List[Dict[str, Any]]:
+        """
+        Top-limit rows by cosine similarity to a query embedding.
+        With a fitment filter only the matching catalog rows and the rows outside the
+        catalog (FAQs, policies) are scored, exactly.
+        """
+        query_vector = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        with self.lock:
+            vectors, records = self.vectors, self.records
+            if len(records) == 0:
+                return []
+            if fitment:
+                rows = np.array([row for row, f in enumerate(self.fitment) if not f or matches_fitment(f, fitment)],
+                                dtype=np.int64)
+                scores = vectors[rows] @ query_vector
+            elif self.lists is not None:
+                probe = np.argsort(-(self.centroids @ query_vector))[:nprobe or self.nprobe]
+                rows = np.concatenate([self.lists[i] for i in probe])
+                scores = vectors[rows] @ query_vector
+            else:
+                rows = None
+                scores = vectors @ query_vector
+
+        limit = min(limit, len(scores))
+        if limit == 0:
+            return []
+        top = np.argpartition(-scores, limit - 1)[:limit]
+        top = top[np.argsort(-scores[top])]
+        results = []
+        for i in top:
+            record = records[rows[i] if rows is not None else i]
+            results.append({
+                "id": record["id"],
+                "content": record["content"],
+                "metadata": record["metadata"],
+                "score": float(scores[i]),
+            })
+        return results
+
+    def part_number_search(self, query: str, k: int = 5, fuzzy_cutoff: float = 0.8) -> List[Dict[str, Any]]:
+        """Chunks mentioning a part number quoted in query, exact matches first, then close ones."""
+        keys = [key for key, _ in extract_part_numbers(query, query=True,
+                                                       exclude=model_keys(self.fitment_catalog))]
+        if not keys:
+            return []
+        with self.lock:
+            records, part_rows = self.records, self.part_rows
+            counts: Dict[int, float] = {}
+            for key in keys:
+                for row in part_rows.get(key, []):
+                    counts[row] = counts.get(row, 0) + 1
+            if not counts:
+                for key in keys:
+                    for close in difflib.get_close_matches(key, list(part_rows), n=k, cutoff=fuzzy_cutoff):
+                        score = difflib.SequenceMatcher(None, key, close).ratio()
+                        for row in part_rows[close]:
+                            counts[row] = max(counts.get(row, 0), score)
+        top = sorted(counts, key=lambda row: (-counts[row], records[row]["id"]))[:k]
+        return [{
+            "id": records[row]["id"],
+            "content": records[row]["content"],
+            "metadata": records[row]["metadata"],
+            "score": float(counts[row]),
+        } for row in top]
+
+    def similarity_search(self, query: str, k: int = 5, probes: int = None,
+                          rerank_budget_ms: float = None, fitment_filter: bool = None,
+                          part_lookup: bool = True, language: str = "English", **kwargs) -> List[Dict[str, Any]]:
+        """
+        Vector search for the top k*5 candidates followed by the configured re-rank.
+        Questions quoting a part number return its chunks directly, and questions
+        naming a vehicle search only its catalog rows when any exist. language is
+        the language of the query text, used for the rerank keywords.
+        """
+        from VectorTools import get_query_embedding
+        start_time = time.time()
+        # Another process (ingest.py, an upload on another worker) may have written since
+        self.refresh()
+        if part_lookup:
+            part_results = self.part_number_search(query, k)
+            if part_results:
+                return part_results
+        query_embedding = get_query_embedding(query)
+        if fitment_filter is None:
+            fitment_filter = self.fitment_filter
+        fitment = parse_fitment_query(query, self.fitment_catalog) if fitment_filter else None
+        candidates = self.search_vector(query_embedding, k * 5, nprobe=probes, fitment=fitment)
+        if fitment and not any(fitment_from_url(c["metadata"].get("url")) for c in candidates):
+            print(f"DEBUG: No catalog rows match fitment {fitment}, searching all documents")
+            candidates = self.search_vector(query_embedding, k * 5, nprobe=probes)
+        reranked_results = self._rerank_results(query, candidates, budget_ms=rerank_budget_ms, language=language)
+        end_time = time.time()
+        print(f"TIMING: Total similarity_search function took {end_time - start_time:.4f} seconds")
+        return reranked_results[:k]
+
+    def get_document_count(self) -> int:
+        """Get the total number of stored documents."""
+        return len(self.records)
@@ -0,0 +1,76 @@
+import re
+from typing import Collection, List, Tuple
+
+# Tool brands whose catalog numbers are often all digits ("OTC 311881")
+TOOL_BRANDS = [
+    "OTC", "LISLE", "KENT-MOORE", "KENT MOORE", "MILLER", "SNAP-ON", "MATCO", "ASSENMACHER",
+    "CTA", "SCHLEY", "GEARWRENCH", "ASTRO", "MOTORCRAFT", "MOPAR", "ACDELCO", "DORMAN",
+]
+
+# Hyphenated codes with letters and digits: FT4Z-6L266-B, 68166445-AA (not 2012-2015)
+HYPHENATED_PATTERN = r"\b[A-Z0-9]{2,}(?:-[A-Z0-9]+)+\b"
+# Single tokens mixing letters and digits, not part of a hyphenated code: KL50003, J45059
+MIXED_PATTERN = r"(?<![\w-])(?=[A-Z0-9]*[0-9])(?=[A-Z0-9]*[A-Z])[A-Z0-9]{5,}(?![\w-])"
+# Brand followed by a number: OTC 311881
+BRAND_PATTERN = r"\b(" + "|".join(re.escape(brand) for brand in TOOL_BRANDS) + r")[\s#-]*([0-9]{4,}[A-Z]?)\b"
+# Bare numbers, only treated as part numbers in questions
+NUMBER_PATTERN = r"(?<![\w-])[0-9]{5,}(?![\w-])"
+# Vanity phone numbers look like hyphenated codes (641-784-TOOL)
+PHONE_PATTERN = re.compile(r"^[0-9]{3}-[0-9]{3}-[0-9A-Z]{4}$")
+
+MIN_KEY_LENGTH = 5
+# Codes carry at least this many digits; names like COVID-19 or bge-m3 have fewer
+MIN_DIGITS = 3
+# A hyphen-separated run of this many letters is a word, not a code segment (SIERRA-3500)
+WORD_SEGMENT_LENGTH = 4
+# Model numbers with a trim suffix (2500HD, 1500LT); part numbers with a letter suffix
+# have more digits (68166445AA)
+MODEL_SUFFIX_PATTERN = re.compile(r"^[0-9]{1,4}[A-Z]{1,3}$")
+
+
+def normalize_part_number(part_number: str) -> str:
+    """Uppercase and drop separators so FT4Z-6L266-B, ft4z 6l266 b and FT4Z6L266B share a key."""
+    return re.sub(r"[^A-Z0-9]", "", part_number.upper())
+
+
+def looks_like_part_number(code: str) -> bool:
+    """Whether a letters-and-digits token has the shape of a part number rather than a name."""
+    code = code.upper()
+    if sum(ch.isdigit() for ch in code) < MIN_DIGITS or PHONE_PATTERN.match(code):
+        return False
+    segments = code.split("-")
+    if any(segment.isalpha() and len(segment) >= WORD_SEGMENT_LENGTH for segment in segments):
+        return False
+    return not MODEL_SUFFIX_PATTERN.match(normalize_part_number(code))
+
+
+def extract_part_numbers(text: str, query: bool = False, exclude: Collection[str] = ()) -> List[Tuple[str, str]]:
+    """
+    Return (key, part number as written) pairs found in text, without duplicate keys.
+
+    Document text is matched case-sensitively because catalog numbers are printed in
+    upper case; questions (query=True) are matched case-insensitively and bare numbers
+    of five or more digits also count, since a pasted number is the whole point.
+    Keys in exclude (normalized vehicle model names such as SIERRA3500) are skipped.
+    """
+    flags = re.IGNORECASE if query else 0
+    found = []
+
+    for match in re.finditer(BRAND_PATTERN, text, flags | re.IGNORECASE):
+        found.append(match.group(0))
+        found.append(match.group(2))
+    for match in re.finditer(HYPHENATED_PATTERN, text, flags):
+        part_number = match.group(0)
+        if any(ch.isalpha() for ch in part_number) and looks_like_part_number(part_number):
+            found.append(part_number)
+    found.extend(match.group(0) for match in re.finditer(MIXED_PATTERN, text, flags)
+                 if looks_like_part_number(match.group(0)))
+    if query:
+        found.extend(match.group(0) for match in re.finditer(NUMBER_PATTERN, text))
+
+    pairs = {}
+    for part_number in found:
+        key = normalize_part_number(part_number)
+        if len(key) >= MIN_KEY_LENGTH and key not in pairs and key not in exclude:
+            pairs[key] = part_number
+    return list(pairs.items())
@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any
+
+# Reranking stage applied to the k*5 retrieval candidates: "heuristic" (phrase and
+# keyword bonuses on the retrieval score) or "cross-encoder" (joint query/passage
+# scoring, falling back to the heuristic order when it misses RERANK_BUDGET_MS).
+RERANKER = os.environ.get("RERANKER", "heuristic")
+RERANK_MODEL_ID = os.environ.get("RERANK_MODEL_ID", "BAAI/bge-reranker-v2-m3")
+RERANK_MAX_LENGTH = int(os.environ.get("RERANK_MAX_LENGTH", 256))
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", 64))
+RERANK_BUDGET_MS = float(os.environ.get("RERANK_BUDGET_MS", 750))
+RERANK_THREADS = int(os.environ.get("RERANK_THREADS", 1))
+
+
+def heuristic_rerank(query: str, candidates: List[Dict[str, Any]], keywords: List[str]) -> List[Dict[str, Any]]:
+    """
+    Order candidates by retrieval score boosted for an exact phrase match (1.5x) and
+    for the share of query keywords the passage contains (up to 1.5x).
+    keywords is extracted once per query by the caller.
+    """
+    query_lower = query.lower()
+    keywords = [keyword for keyword in keywords if keyword]
+    for doc in candidates:
+        content = doc["content"].lower()
+        exact_match_bonus = 1.5 if query_lower in content else 1.0
+        keyword_count = sum(1 for keyword in keywords if keyword in content)
+        keyword_density = keyword_count / len(keywords) if keywords else 0
+        doc["final_score"] = doc["score"] * exact_match_bonus * (1 + keyword_density * 0.5)
+    return sorted(candidates, key=lambda x: x.get("final_score", 0), reverse=True)
+
+
+class HeuristicReranker:
+    """Reranks with heuristic_rerank only."""
+
+    name = "heuristic"
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]], keywords: List[str],
+               budget_ms: float = None) -> List[Dict[str, Any]]:
+        return heuristic_rerank(query, candidates, keywords)
+
+    def warm(self):
+        """Nothing to load."""
+
+    def stats(self) -> dict:
+        return {"reranker": self.name}
+
+
+class CrossEncoderReranker:
+    """
+    Scores every (query, passage) pair with a cross-encoder in one batched forward
+    pass, truncating pairs to max_length tokens.
+
+    Scoring runs on a small dedicated thread pool so the caller can stop waiting once
+    the time budget is spent and use the heuristic order instead. The model is loaded
+    on that pool too, so requests made while it loads fall back rather than block.
+    If every scoring thread is still busy with an earlier request that ran over, the
+    request falls back immediately instead of queueing behind it.
+    """
+
+    name = "cross-encoder"
+
+    def __init__(self, model_id: str = RERANK_MODEL_ID, max_length: int = RERANK_MAX_LENGTH,
+                 batch_size: int = RERANK_BATCH_SIZE, budget_ms: float = RERANK_BUDGET_MS,
+                 threads: int = RERANK_THREADS):
+        self.model_id = model_id
+        self.max_length = max_length
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self.model = None
+        self.model_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="rerank")
+        self.slots = threading.BoundedSemaphore(threads)
+        self.stats_lock = threading.Lock()
+        self.scored = 0
+        self.fallbacks = {"timeout": 0, "busy": 0, "error": 0}
+
+    def get_model(self):
+        """Load the cross-encoder on first use."""
+        with self.model_lock:
+            if self.model is None:
+                from sentence_transformers import CrossEncoder
+                start_time = time.time()
+                self.model = CrossEncoder(self.model_id, max_length=self.max_length, device="cpu")
+                print(f"TIMING: Loading reranker {self.model_id} took {time.time() - start_time:.4f} seconds")
+            return self.model
+
+    def warm(self):
+        """Load the model and score one pair so the first request isn't a fallback."""
+        start_time = time.time()
+        self.get_model().predict([("warmup", "warmup")], show_progress_bar=False)
+        print(f"TIMING: Reranker warmup took {time.time() - start_time:.4f} seconds")
+
+    def _score(self, query: str, passages: List[str]) -> List[float]:
+        try:
+            model = self.get_model()
+            pairs = [(query, passage) for passage in passages]
+            return [float(score) for score in model.predict(pairs, batch_size=self.batch_size,
+                                                             show_progress_bar=False)]
+        finally:
+            self.slots.release()
+
+    def _fallback(self, reason: str, ordered: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        with self.stats_lock:
+            self.fallbacks[reason] += 1
+        print(f"Reranker fallback ({reason}), using heuristic order")
+        return ordered
+
+    def rerank(self, query: str, candidates: List[Dict[str, Any]], keywords: List[str],
+               budget_ms: float = None) -> List[Dict[str, Any]]:
+        """Cross-encoder order of candidates, or the heuristic order if over budget_ms."""
+        ordered = heuristic_rerank(query, candidates, keywords)
+        if not ordered:
+            return ordered
+        if budget_ms is None:
+            budget_ms = self.budget_ms
+
+        if not self.slots.acquire(blocking=False):
+            return self._fallback("busy", ordered)
+        try:
+            future = self.executor.submit(self._score, query, [doc["content"] for doc in ordered])
+        except Exception:
+            self.slots.release()
+            raise
+        try:
+            scores = future.result(timeout=budget_ms / 1000)
+        except FutureTimeoutError:
+            return self._fallback("timeout", ordered)
+        except Exception as e:
+            print(f"Error scoring with reranker: {e}")
+            return self._fallback("error", ordered)
+
+        for doc, score in zip(ordered, scores):
+            doc["rerank_score"] = score
+            doc["final_score"] = score
+        with self.stats_lock:
+            self.scored += 1
+        # Stable sort keeps the heuristic order between equal cross-encoder scores
+        return sorted(ordered, key=lambda x: x["final_score"], reverse=True)
+
+    def stats(self) -> dict:
+        with self.stats_lock:
+            return {
+                "reranker": self.name,
+                "model": self.model_id,
+                "loaded": self.model is not None,
+                "budget_ms": self.budget_ms,
+                "scored": self.scored,
+                "fallbacks": dict(self.fallbacks),
+            }
+
+
+def get_reranker():
+    """Get the process-wide reranker selected by RERANKER."""
+    if not hasattr(get_reranker, "instance"):
+        if RERANKER == "cross-encoder":
+            get_reranker.instance = CrossEncoderReranker()
+        elif RERANKER == "heuristic":
+            get_reranker.instance = HeuristicReranker()
+        else:
+            raise ValueError(f"Unknown RERANKER {RERANKER!r}, expected 'heuristic' or 'cross-encoder'")
+    return get_reranker.instance
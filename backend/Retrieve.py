@@ -1,7 +1,6 @@
 import time
 import os
 import datetime
-import re
 from dotenv import load_dotenv
 from langchain_community.llms import Ollama
 from langchain_core.prompts import PromptTemplate
@@ -9,15 +8,24 @@ from langchain.chains import create_retrieval_chain
 from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain_core.documents import Document
 from langchain_core.retrievers import BaseRetriever
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Tuple, AsyncIterator
 from pydantic import Field
 import langdetect
+from langdetect import DetectorFactory
 from langdetect.lang_detect_exception import LangDetectException
 import asyncio
+import functools
 from concurrent.futures import ThreadPoolExecutor
 import threading
+import requests
 
-from VectorTools import VectorDB
+from VectorTools import create_vector_store, get_query_embedding, EMBED_DIM, PART_LOOKUP, EMBED_QUERY_BATCH_SIZE
+from AnswerCache import AnswerCache
+from StorePool import VectorStorePool
+from Admission import AdmissionController
+from SingleFlight import SingleFlight, Flight
+from EmbeddingCache import normalize_query
+from TranslationMemory import TranslationMemory
 
 # Load environment variables from .env file
 load_dotenv()
@@ -32,47 +40,145 @@ CONN_PARAMS = {
     "password": POSTGRESPASS
 }
 
+# Ollama model used for answers and translation; keep_alive keeps it loaded between
+# requests instead of letting Ollama unload it after its 5 minute default
+OLLAMA_MODEL = os.environ.get("OLLAMA_MODEL", "qwen3:4b")
+OLLAMA_BASE_URL = os.environ.get("OLLAMA_BASE_URL", "http://localhost:11434")
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# Chunks passed to the LLM after reranking; fewer chunks means a shorter prompt
+RETRIEVE_K = int(os.environ.get("RETRIEVE_K", 5))
+
+# Cache of answers for repeated and near-duplicate questions
+answer_cache = AnswerCache(
+    EMBED_DIM,
+    max_size=int(os.environ.get("ANSWER_CACHE_SIZE", 2048)),
+    ttl=float(os.environ.get("ANSWER_CACHE_TTL", 21600)),
+    threshold=float(os.environ.get("ANSWER_CACHE_THRESHOLD", 0.95))
+)
+
+# How non-English questions are searched: "multilingual" embeds and keyword-searches
+# the question as asked (bge-m3 is multilingual) and the LLM answers in the question's
+# language from English context; "translate" first translates it to English with an
+# LLM call, remembering translations in translation_memory.
+QUERY_TRANSLATION = os.environ.get("QUERY_TRANSLATION", "multilingual")
+translation_memory = TranslationMemory(
+    max_size=int(os.environ.get("TRANSLATION_MEMORY_SIZE", 4096)),
+    ttl=float(os.environ.get("TRANSLATION_MEMORY_TTL", 86400))
+)
+
+# langdetect is randomized; a fixed seed gives the same answer for the same text,
+# which makes memoizing it safe
+DetectorFactory.seed = 0
+LANGDETECT_CACHE_SIZE = int(os.environ.get("LANGDETECT_CACHE_SIZE", 4096))
+
+# In-progress answers shared by identical concurrent questions
+query_flights = SingleFlight()
+
 # Thread-local storage for LLM instances
 thread_local = threading.local()
 
-# Global connection pool for database connections
-db_connection_pool = []
-db_pool_lock = threading.Lock()
-MAX_DB_CONNECTIONS = 10
+# Global connection pool for database connections. The schema is created at deploy
+# time (python reindex.py setup, or any ingest run), so pooled connections skip it.
+MIN_DB_CONNECTIONS = int(os.environ.get("DB_POOL_MIN_SIZE", 2))
+MAX_DB_CONNECTIONS = int(os.environ.get("DB_POOL_MAX_SIZE", 10))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 10))
+DB_POOL_CHECK_INTERVAL = float(os.environ.get("DB_POOL_CHECK_INTERVAL", 30))
+db_pool = VectorStorePool(
+    lambda: create_vector_store(CONN_PARAMS, setup=False),
+    min_size=MIN_DB_CONNECTIONS,
+    max_size=MAX_DB_CONNECTIONS,
+    timeout=DB_POOL_TIMEOUT,
+    check_interval=DB_POOL_CHECK_INTERVAL
+)
+
+# The query pipeline runs on the event loop. Ollama calls are awaited natively; the
+# blocking steps run on bounded executors: langdetect on model_executor, query
+# embeddings on embed_executor, and psycopg2 retrieval on db_executor, which has
+# one thread per pooled connection. embed_executor threads mostly wait on the
+# embedding batcher, so it has one per batch slot to let a full batch form.
+MODEL_THREADS = int(os.environ.get("MODEL_THREADS", 2))
+EMBED_CONCURRENCY = max(MODEL_THREADS, EMBED_QUERY_BATCH_SIZE)
+model_executor = ThreadPoolExecutor(max_workers=MODEL_THREADS, thread_name_prefix="model")
+embed_executor = ThreadPoolExecutor(max_workers=EMBED_CONCURRENCY, thread_name_prefix="embed")
+db_executor = ThreadPoolExecutor(max_workers=MAX_DB_CONNECTIONS, thread_name_prefix="db")
+
+# Admission control: at most ADMISSION_MAX_PENDING queries in the pipeline (fewer per
+# client), each stage limited to its concurrency and shared fairly between clients.
+# The db stage matches the pool size, so no executor thread sits waiting for a
+# connection that another query needs a thread to give back. LLM_CONCURRENCY should
+# match what Ollama serves in parallel (OLLAMA_NUM_PARALLEL).
+LLM_CONCURRENCY = int(os.environ.get("LLM_CONCURRENCY", 2))
+admission = AdmissionController(
+    {"embedding": EMBED_CONCURRENCY, "db": MAX_DB_CONNECTIONS, "llm": LLM_CONCURRENCY},
+    max_pending=int(os.environ.get("ADMISSION_MAX_PENDING", 32)),
+    max_pending_per_client=int(os.environ.get("ADMISSION_MAX_PER_CLIENT", 4)),
+    max_retry_after=int(os.environ.get("ADMISSION_MAX_RETRY_AFTER", 60))
+)
+
+async def run_blocking(executor: ThreadPoolExecutor, fn, *args, **kwargs):
+    """Await a blocking call on one of the pipeline executors."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, functools.partial(fn, *args, **kwargs))
 
 def get_db_connection():
-    """Get a database connection from the pool or create a new one."""
-    with db_pool_lock:
-        if db_connection_pool:
-            return db_connection_pool.pop()
-        else:
-            return VectorDB(CONN_PARAMS)
+    """Get a database connection from the pool, waiting up to DB_POOL_TIMEOUT seconds."""
+    return db_pool.acquire()
 
-def return_db_connection(vector_db):
-    """Return a database connection to the pool."""
-    with db_pool_lock:
-        if len(db_connection_pool) < MAX_DB_CONNECTIONS:
-            db_connection_pool.append(vector_db)
-        else:
-            vector_db.close()
+def return_db_connection(vector_db, failed: bool = False):
+    """Return a database connection to the pool, re-checking it if the query failed."""
+    db_pool.release(vector_db, check=failed)
+
+async def run_on_pooled_store(client_id: str, method: str, *args, **kwargs):
+    """Call a vector store method on a pooled connection, inside the db stage."""
+    async with admission.stage("db", client_id):
+        vector_db = await run_blocking(db_executor, get_db_connection)
+        query_failed = True
+        try:
+            result = await run_blocking(db_executor, getattr(vector_db, method), *args, **kwargs)
+            query_failed = False
+            return result
+        finally:
+            # Always return the database connection to the pool; a failed connection is
+            # pinged before reuse, which is a round trip, so that happens off the loop
+            if query_failed:
+                await run_blocking(db_executor, return_db_connection, vector_db, failed=True)
+            else:
+                return_db_connection(vector_db)
 
 def get_llm_instance():
-    """Get or create an LLM instance for the current thread."""
+    """
+    Get or create an LLM instance for the current thread. The query pipeline only
+    uses it from the event loop thread, through ainvoke/astream.
+    """
     if not hasattr(thread_local, 'llm'):
         thread_local.llm = Ollama(
-            model="qwen3:4b",
-            base_url="http://localhost:11434",
+            model=OLLAMA_MODEL,
+            base_url=OLLAMA_BASE_URL,
             temperature=0.2,
-            top_p=0.95
+            top_p=0.95,
+            keep_alive=OLLAMA_KEEP_ALIVE
         )
     return thread_local.llm
 
+def warm_llm(timeout: float = 300):
+    """Ask Ollama to load the model now (an empty generate request) and keep it loaded."""
+    start_time = time.time()
+    response = requests.post(
+        f"{OLLAMA_BASE_URL}/api/generate",
+        json={"model": OLLAMA_MODEL, "keep_alive": OLLAMA_KEEP_ALIVE},
+        timeout=timeout
+    )
+    response.raise_for_status()
+    end_time = time.time()
+    print(f"TIMING: Ollama model {OLLAMA_MODEL} warmup took {end_time - start_time:.4f} seconds")
+
 def create_prompt_template(language: str = "English") -> PromptTemplate:
     """
     Create a prompt template for the specified language.
     This eliminates the need for separate PROMPT and SPANISH_PROMPT templates.
     """
-    language_instruction = "" if language == "English" else "Respond in Spanish."
+    language_instruction = "" if language == "English" else "The context may be in English; respond in Spanish."
     
     return PromptTemplate.from_template(
         f""""role": "You are an AI assistant for the FreedomRacing. Which is a Tool and Auto,
@@ -107,12 +213,27 @@ def create_prompt_template(language: str = "English") -> PromptTemplate:
         \nQuery: {{input}}\nAnswer:\n"""
     )
 
-def detect_language_and_translate(query: str) -> List[str]:
+@functools.lru_cache(maxsize=LANGDETECT_CACHE_SIZE)
+def _detect_language_code(text: str) -> str:
+    try:
+        return langdetect.detect(text)
+    except LangDetectException:
+        return 'en'  # Default to English if detection fails
+
+def detect_language(query: str) -> str:
+    """Return "Spanish" or "English" for the query, memoized per normalized text."""
+    lang = _detect_language_code(normalize_query(query))
+    return "Spanish" if lang == 'es' else "English"
+
+async def detect_language_and_translate(query: str, language: str = None,
+                                       client_id: str = "anonymous") -> List[str]:
     """
     Detects if the query is in Spanish or English and translates if necessary.
+    Pass language to skip detection when it is already known.
     Returns a list where:
     - First element is "Spanish" or "English"
     - Second element is the English translation if Spanish, or the original query if English
+      or in multilingual mode (QUERY_TRANSLATION), which makes no LLM call
     """
     start_time = time.time()
     llm = get_llm_instance()
@@ -122,22 +243,22 @@ def detect_language_and_translate(query: str) -> List[str]:
         "Translate the following Spanish text to English, keep the meaning and don't add any extra text, just the translation: {query}"
     )
     
-    try:
-        lang = langdetect.detect(query)
-    except LangDetectException:
-        lang = 'en'  # Default to English if detection fails
+    if language is None:
+        async with admission.stage("embedding", client_id):
+            language = await run_blocking(model_executor, detect_language, query)
 
-    if lang == 'es':
-        language = "Spanish"
-        # Translate from Spanish to English
-        translation_prompt = translate_prompt.format(query=query)
-        llm_start = time.time()
-        translation = llm.predict(translation_prompt).strip()
-        llm_end = time.time()
-        print(f"TIMING: Spanish translation LLM call took {llm_end - llm_start:.4f} seconds")
-    else:
-        language = "English"
-        translation = query
+    translation = query
+    if language == "Spanish" and QUERY_TRANSLATION == "translate":
+        translation = translation_memory.get(query)
+        if translation is None:
+            # Translate from Spanish to English
+            translation_prompt = translate_prompt.format(query=query)
+            llm_start = time.time()
+            async with admission.stage("llm", client_id):
+                translation = (await llm.ainvoke(translation_prompt)).strip()
+            llm_end = time.time()
+            print(f"TIMING: Spanish translation LLM call took {llm_end - llm_start:.4f} seconds")
+            translation_memory.put(query, translation)
     
     end_time = time.time()
     print(f"TIMING: detect_language_and_translate took {end_time - start_time:.4f} seconds")
@@ -184,74 +305,238 @@ def extract_sources(results: List[Dict]) -> List[Dict]:
             sources.append(source_info)
     return sources
 
-async def process_query(query: str) -> Dict[str, Any]:
-    start_time = time.time()
+THINK_OPEN, THINK_CLOSE = "<think>", "</think>"
+
+def _partial_tag_length(text: str, tag: str) -> int:
+    """Length of the longest suffix of text that is a proper prefix of tag."""
+    for length in range(min(len(tag) - 1, len(text)), 0, -1):
+        if text.endswith(tag[:length]):
+            return length
+    return 0
+
+class ThinkFilter:
+    """
+    Removes <think>...</think> reasoning from streamed text. feed() returns the
+    visible text that is safe to emit, holding back anything that could be the start
+    of a tag split across chunks; flush() returns what is left at the end of the stream.
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.in_think = False
+        self.started = False
+
+    def _visible(self, text: str) -> str:
+        # Drop the whitespace left before the answer
+        if not self.started:
+            text = text.lstrip()
+            self.started = bool(text)
+        return text
+
+    def feed(self, text: str) -> str:
+        self.buffer += text
+        output = []
+        while True:
+            if self.in_think:
+                end = self.buffer.find(THINK_CLOSE)
+                if end == -1:
+                    keep = _partial_tag_length(self.buffer, THINK_CLOSE)
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+                self.buffer = self.buffer[end + len(THINK_CLOSE):]
+                self.in_think = False
+            else:
+                start = self.buffer.find(THINK_OPEN)
+                if start == -1:
+                    keep = _partial_tag_length(self.buffer, THINK_OPEN)
+                    output.append(self.buffer[:len(self.buffer) - keep])
+                    self.buffer = self.buffer[len(self.buffer) - keep:]
+                    break
+                output.append(self.buffer[:start])
+                self.buffer = self.buffer[start + len(THINK_OPEN):]
+                self.in_think = True
+        return self._visible("".join(output))
+
+    def flush(self) -> str:
+        text = "" if self.in_think else self.buffer
+        self.buffer = ""
+        return self._visible(text)
+
+async def retrieve_context(query: str, query_language: str, client_id: str = "anonymous") -> Dict[str, Any]:
+    """
+    Retrieval half of answering a query: the part-number fast path, or translation
+    plus similarity search, each on a pooled connection held only for that call.
+    The part-number lookup and the translation run concurrently, and the translation
+    is cancelled when the lookup finds the part.
+    """
+    lang_start = time.time()
+    translation = asyncio.ensure_future(detect_language_and_translate(query, query_language, client_id))
     
     try:
-        # Get database connection from pool
-        vector_db = get_db_connection()
-        
-        try:
+        # Part numbers read the same in any language, so a hit on the raw query
+        # skips translation and the vector search entirely
+        results = []
+        if PART_LOOKUP:
+            results = await run_on_pooled_store(client_id, "part_number_search", query, k=RETRIEVE_K)
+        if results:
+            language_info = [query_language, query]
+        else:
             # Detect language and translate if necessary
-            lang_start = time.time()
-            language_info = detect_language_and_translate(query)
+            language_info = await translation
             lang_end = time.time()
             print(f"TIMING: Language detection and translation took {lang_end - lang_start:.4f} seconds")
-            print(language_info)
-            
-            # language_info[0] is "Spanish" or "English"
-            # language_info[1] is the translated query (or original if English)
-            detected_language = language_info[0]
-            search_query = language_info[1]  # Use the English query for vector search
-            
-            # Get current date for including in prompt
-            current_date = datetime.datetime.now().strftime("%A, %B %d, %Y")
-            
+        print(language_info)
+        
+        # language_info[0] is "Spanish" or "English"
+        # language_info[1] is the translated query (or the original if English or multilingual)
+        search_query = language_info[1]
+        search_language = language_info[0] if search_query == query else "English"
+        
+        if not results:
             # Perform similarity search
             vector_start = time.time()
             print(f"DEBUG: About to perform vector search with query: {search_query}")
-            results = vector_db.similarity_search(search_query, k=5)
+            results = await run_on_pooled_store(client_id, "similarity_search", search_query,
+                                                k=RETRIEVE_K, part_lookup=False, language=search_language)
             vector_end = time.time()
             for result in results:
                 print(Document(page_content=result['content']))
             print(f"TIMING: Vector similarity search took {vector_end - vector_start:.4f} seconds")
-            print(f"DEBUG: Found {len(results)} results from vector search")
-            
-            # Extract sources from results
-            sources = extract_sources(results)
+        print(f"DEBUG: Found {len(results)} results")
+    finally:
+        if not translation.done():
+            translation.cancel()
 
-            # Convert results to Document objects
-            documents = [Document(page_content=result['content'], metadata=result['metadata']) for result in results]
-            print(f"DEBUG: Created {len(documents)} Document objects")
+    # Convert results to Document objects
+    documents = [Document(page_content=result['content'], metadata=result['metadata']) for result in results]
+    print(f"DEBUG: Created {len(documents)} Document objects")
 
+    return {
+        "language_info": language_info,
+        "language": language_info[0],
+        "search_query": search_query,
+        "sources": extract_sources(results),
+        "documents": documents,
+        # Get current date for including in prompt
+        "current_date": datetime.datetime.now().strftime("%A, %B %d, %Y"),
+    }
 
-            # Create RAG chain for the detected language
-            llm_start = time.time()
-            rag_chain = create_rag_chain(documents, detected_language, current_date)
-            
-            # Get response using the English query
-            print(f"DEBUG: About to invoke RAG chain with query: {search_query}")
-            response = rag_chain.invoke({"input": search_query})
+async def lookup_answer_cache(query: str, client_id: str = "anonymous") -> Tuple[Dict[str, Any], str, Any, str]:
+    """
+    Detect the language and embed the query concurrently, then look the query up in
+    the answer cache. Returns (cached result or None, match type, embedding, language).
+    The embedding lands in the query embedding cache, so an English query's vector
+    search reuses it.
+    """
+    cache_start = time.time()
+    async with admission.stage("embedding", client_id):
+        query_language, query_embedding = await asyncio.gather(
+            run_blocking(model_executor, detect_language, query),
+            run_blocking(embed_executor, get_query_embedding, query)
+        )
+    cached_result, cache_match, query_embedding = answer_cache.lookup(
+        query, query_language, lambda: query_embedding
+    )
+    cache_end = time.time()
+    if cached_result is not None:
+        print(f"TIMING: Answer cache {cache_match} hit took {cache_end - cache_start:.4f} seconds")
+    return cached_result, cache_match, query_embedding, query_language
 
-            # Remove <think>...</think> content
-            if response.get("answer"):
-                response["answer"] = re.sub(r"<think>.*?</think>", "", response["answer"], flags=re.DOTALL).strip()
+async def answer_events(query: str, query_language: str, query_embedding, client_id: str,
+                        start_time: float) -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Retrieval and generation for a query that missed the answer cache, as the events
+    described in stream_query. The answer is stored in the answer cache before "done".
+    """
+    try:
+        context = await retrieve_context(query, query_language, client_id)
+        retrieval_time = time.time() - start_time
+        yield "sources", {"sources": context["sources"], "language_info": context["language_info"]}
 
-            llm_end = time.time()
-            print(f"TIMING: LLM response generation took {llm_end - llm_start:.4f} seconds")
-            
-            end_time = time.time()
-            print(f"TIMING: Total process_query function took {end_time - start_time:.4f} seconds")
-            
-            return {
-                "answer": response["answer"],
-                "sources": sources,
-                "language_info": language_info
-            }
-                
-        finally:
-            # Always return the database connection to the pool
-            return_db_connection(vector_db)
+        # Create RAG chain for the detected language
+        llm_start = time.time()
+        rag_chain = create_rag_chain(context["documents"], context["language"], context["current_date"])
+
+        # Stream the response to the English query, dropping <think>...</think> content
+        print(f"DEBUG: About to stream RAG chain with query: {context['search_query']}")
+        think_filter = ThinkFilter()
+        answer_parts = []
+        first_token_time = None
+        async with admission.stage("llm", client_id):
+            async for chunk in rag_chain.astream({"input": context["search_query"]}):
+                text = think_filter.feed(chunk.get("answer") or "")
+                if text:
+                    if first_token_time is None:
+                        first_token_time = time.time() - start_time
+                        print(f"TIMING: Time to first answer token {first_token_time:.4f} seconds")
+                    answer_parts.append(text)
+                    yield "token", {"text": text}
+        text = think_filter.flush()
+        if text:
+            answer_parts.append(text)
+            yield "token", {"text": text}
+
+        end_time = time.time()
+        print(f"TIMING: LLM response generation took {end_time - llm_start:.4f} seconds")
+        print(f"TIMING: Total answer pipeline took {end_time - start_time:.4f} seconds")
+        answer_cache.store(query, query_language, query_embedding, {
+            "answer": "".join(answer_parts).strip(),
+            "sources": context["sources"],
+            "language_info": context["language_info"]
+        })
+        yield "done", {"timing": {
+            "retrieval_time": f"{retrieval_time:.4f} seconds",
+            "time_to_first_token": f"{first_token_time or end_time - start_time:.4f} seconds",
+            "total_time": f"{end_time - start_time:.4f} seconds"
+        }}
+
+    except Exception as e:
+        end_time = time.time()
+        print(f"TIMING: Answer pipeline failed after {end_time - start_time:.4f} seconds")
+        print(f"ERROR DETAILS: {str(e)}")
+        import traceback
+        print(f"TRACEBACK: {traceback.format_exc()}")
+        yield "error", {"error": str(e)}
+
+def join_answer_flight(query: str, query_language: str, query_embedding, client_id: str,
+                       start_time: float) -> Tuple[Flight, bool]:
+    """
+    Attach to the in-progress answer for the same normalized query and language, or
+    start one. Returns (flight, True if this request started it).
+    """
+    key = (normalize_query(query), query_language)
+    return query_flights.join(
+        key, lambda: answer_events(query, query_language, query_embedding, client_id, start_time)
+    )
+
+async def process_query(query: str, client_id: str = "anonymous") -> Dict[str, Any]:
+    start_time = time.time()
+    
+    try:
+        # Serve repeated and near-duplicate questions without touching the DB or the LLM
+        cached_result, cache_match, query_embedding, query_language = await lookup_answer_cache(query, client_id)
+        if cached_result is not None:
+            return dict(cached_result, cache=cache_match)
+
+        # Identical questions asked while this one is being answered share its answer
+        flight, leader = join_answer_flight(query, query_language, query_embedding, client_id, start_time)
+        result = {"answer": "", "sources": [], "language_info": [query_language, query]}
+        answer_parts = []
+        async for event, data in flight.subscribe():
+            if event == "sources":
+                result["sources"] = data["sources"]
+                result["language_info"] = data["language_info"]
+            elif event == "token":
+                answer_parts.append(data["text"])
+            elif event == "error":
+                return {"error": data["error"]}
+        result["answer"] = "".join(answer_parts).strip()
+        if not leader:
+            result["coalesced"] = True
+
+        end_time = time.time()
+        print(f"TIMING: Total process_query function took {end_time - start_time:.4f} seconds")
+        return result
             
     except Exception as e:
         end_time = time.time()
@@ -261,6 +546,41 @@ async def process_query(query: str) -> Dict[str, Any]:
         print(f"TRACEBACK: {traceback.format_exc()}")
         return {"error": str(e)}
 
+async def stream_query(query: str, client_id: str = "anonymous") -> AsyncIterator[Tuple[str, Dict[str, Any]]]:
+    """
+    Streaming variant of process_query. Yields (event, data) pairs:
+    - "sources" with sources and language_info as soon as retrieval finishes
+    - "token" with each piece of visible answer text as the LLM produces it
+    - "done" with timing (and "cache" when answered from the answer cache, or
+      "coalesced" when another request was already generating the same answer)
+    - "error" instead of the remaining events if anything fails
+    """
+    start_time = time.time()
+    
+    try:
+        cached_result, cache_match, query_embedding, query_language = await lookup_answer_cache(query, client_id)
+        if cached_result is not None:
+            yield "sources", {"sources": cached_result["sources"], "language_info": cached_result["language_info"]}
+            yield "token", {"text": cached_result["answer"]}
+            yield "done", {"cache": cache_match, "timing": {"total_time": f"{time.time() - start_time:.4f} seconds"}}
+            return
+
+        # Fan the in-progress answer out to every request for the same question;
+        # a request that joins late is replayed the events it missed
+        flight, leader = join_answer_flight(query, query_language, query_embedding, client_id, start_time)
+        async for event, data in flight.subscribe():
+            if event == "done" and not leader:
+                data = dict(data, coalesced=True)
+            yield event, data
+
+    except Exception as e:
+        end_time = time.time()
+        print(f"TIMING: stream_query function failed after {end_time - start_time:.4f} seconds")
+        print(f"ERROR DETAILS: {str(e)}")
+        import traceback
+        print(f"TRACEBACK: {traceback.format_exc()}")
+        yield "error", {"error": str(e)}
+
 class SimpleRetriever(BaseRetriever):
     documents: List[Document] = Field(default_factory=list)
 
@@ -274,13 +594,13 @@ if __name__ == "__main__":
     # Test with an English query
     test_query = "Tell me about City Council"
     print(f"Testing with English query: {test_query}")
-    result = process_query(test_query)
+    result = asyncio.run(process_query(test_query))
     print(f"Language detection: {result.get('language_info', ['Unknown', ''])}")
     
     # Test with a Spanish query
     test_query_spanish = "Háblame del Concejo Municipal"
     print(f"Testing with Spanish query: {test_query_spanish}")
-    result_spanish = process_query(test_query_spanish)
+    result_spanish = asyncio.run(process_query(test_query_spanish))
     print(f"Language detection: {result_spanish.get('language_info', ['Unknown', ''])}")
     
     # Close connection
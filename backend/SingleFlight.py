@@ -0,0 +1,94 @@
+import asyncio
+from typing import Any, AsyncIterator, Callable, Dict, Hashable, List, Tuple
+
+Event = Tuple[str, Dict[str, Any]]
+
+
+class Flight:
+    """
+    Events of one in-progress pipeline run, shared by every request waiting on it.
+    Subscribers replay the events published so far and then follow new ones, so a
+    request that joins late still gets the whole stream.
+    """
+
+    def __init__(self):
+        self.events: List[Event] = []
+        self.finished = False
+        self.subscribers = 0
+        self.updated = asyncio.Event()
+
+    def publish(self, event: str, data: Dict[str, Any]):
+        self.events.append((event, data))
+        self._wake()
+
+    def finish(self):
+        self.finished = True
+        self._wake()
+
+    def _wake(self):
+        # Wake everyone waiting on the current event and start a new one for the next wait
+        updated, self.updated = self.updated, asyncio.Event()
+        updated.set()
+
+    async def subscribe(self) -> AsyncIterator[Event]:
+        index = 0
+        while True:
+            while index < len(self.events):
+                yield self.events[index]
+                index += 1
+            if self.finished:
+                return
+            await self.updated.wait()
+
+
+class SingleFlight:
+    """
+    Runs at most one pipeline per key at a time. The first request for a key starts
+    produce() as a background task; identical requests arriving while it runs join
+    the same Flight instead of starting their own. The task is not tied to any one
+    request, so the first requester disconnecting doesn't cut the others off. The
+    key is dropped as soon as the run finishes. Runs on the event loop only.
+    """
+
+    def __init__(self):
+        self.flights: Dict[Hashable, Flight] = {}
+        self.tasks = set()
+        self.started = 0
+        self.coalesced = 0
+
+    def join(self, key: Hashable, produce: Callable[[], AsyncIterator[Event]]) -> Tuple[Flight, bool]:
+        """Return (flight for key, True if this call started it)."""
+        flight = self.flights.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            flight.subscribers += 1
+            return flight, False
+
+        flight = self.flights[key] = Flight()
+        flight.subscribers = 1
+        self.started += 1
+        task = asyncio.ensure_future(self._run(key, flight, produce))
+        # Keep a reference so the task isn't collected mid-run
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        return flight, True
+
+    async def _run(self, key: Hashable, flight: Flight, produce: Callable[[], AsyncIterator[Event]]):
+        try:
+            async for event, data in produce():
+                flight.publish(event, data)
+        except Exception as e:
+            print(f"Error in shared query run: {e}")
+            flight.publish("error", {"error": str(e)})
+        finally:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+            flight.finish()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": len(self.flights),
+            "requests": sum(flight.subscribers for flight in self.flights.values()),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,171 @@
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, List, Tuple
+
+from VectorStore import VectorStore
+
+
+class PoolTimeout(Exception):
+    """No vector store connection became available within the acquire timeout."""
+
+
+class VectorStorePool:
+    """
+    Bounded, thread-safe pool of open vector store connections for the query path.
+
+    Holds between min_size and max_size stores made by factory. prewarm() opens
+    min_size up front so the first requests don't pay for connecting. A store idle
+    for longer than check_interval seconds is pinged with is_connected() before it
+    is handed out, and a broken one is closed and replaced. acquire() waits at most
+    timeout seconds for a free store and then raises PoolTimeout.
+    """
+
+    def __init__(self, factory: Callable[[], VectorStore], min_size: int = 2, max_size: int = 10,
+                 timeout: float = 10.0, check_interval: float = 30.0):
+        if min_size > max_size:
+            raise ValueError("min_size must not exceed max_size")
+        self.factory = factory
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.check_interval = check_interval
+        self.condition = threading.Condition()
+        self.idle: List[Tuple[VectorStore, float]] = []  # (store, released_at), most recent last
+        self.size = 0  # open stores, idle or checked out
+        self.waiting = 0
+        self.closed = False
+
+        self.created = 0
+        self.replaced = 0
+        self.timeouts = 0
+
+    def _open(self) -> VectorStore:
+        """Create a store for a slot already counted in size, giving the slot back on failure."""
+        try:
+            store = self.factory()
+        except Exception:
+            with self.condition:
+                self.size -= 1
+                self.condition.notify()
+            raise
+        with self.condition:
+            self.created += 1
+        return store
+
+    def _discard(self, store: VectorStore):
+        """Close a store whose slot has already been released."""
+        try:
+            store.close()
+        except Exception as e:
+            print(f"Error closing pooled connection: {e}")
+
+    def prewarm(self):
+        """Open connections until min_size are available."""
+        start_time = time.time()
+        opened = 0
+        while True:
+            with self.condition:
+                if self.closed or self.size >= self.min_size:
+                    break
+                self.size += 1
+            store = self._open()
+            self.release(store, check=False)
+            opened += 1
+        end_time = time.time()
+        print(f"TIMING: Pool prewarm opened {opened} connections in {end_time - start_time:.4f} seconds")
+
+    def acquire(self, timeout: float = None) -> VectorStore:
+        """Check out a live store, waiting up to timeout (default self.timeout) seconds."""
+        timeout = self.timeout if timeout is None else timeout
+        deadline = time.monotonic() + timeout
+        while True:
+            with self.condition:
+                while not self.idle and self.size >= self.max_size and not self.closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.timeouts += 1
+                        raise PoolTimeout(f"No database connection available after {timeout:.1f} seconds "
+                                          f"({self.size} of {self.max_size} in use)")
+                    self.waiting += 1
+                    try:
+                        self.condition.wait(remaining)
+                    finally:
+                        self.waiting -= 1
+                if self.closed:
+                    raise PoolTimeout("Connection pool is closed")
+                if self.idle:
+                    store, released_at = self.idle.pop()
+                else:
+                    self.size += 1
+                    store, released_at = None, None
+
+            if store is None:
+                return self._open()
+            if time.monotonic() - released_at < self.check_interval or store.is_connected():
+                return store
+
+            # Broken connection: free its slot and go round again for a replacement
+            print("Replacing broken pooled connection")
+            with self.condition:
+                self.size -= 1
+                self.replaced += 1
+                self.condition.notify()
+            self._discard(store)
+
+    def release(self, store: VectorStore, check: bool = False):
+        """Return a store to the pool. With check=True it is dropped if it no longer answers."""
+        if check and not store.is_connected():
+            print("Dropping broken pooled connection")
+            with self.condition:
+                self.size -= 1
+                self.replaced += 1
+                self.condition.notify()
+            self._discard(store)
+            return
+        with self.condition:
+            if self.closed:
+                self.size -= 1
+                discard = True
+            else:
+                self.idle.append((store, time.monotonic()))
+                discard = False
+            self.condition.notify()
+        if discard:
+            self._discard(store)
+
+    @contextmanager
+    def connection(self, timeout: float = None):
+        """Context manager around acquire/release; a store is re-checked if the block raised."""
+        store = self.acquire(timeout)
+        failed = True
+        try:
+            yield store
+            failed = False
+        finally:
+            self.release(store, check=failed)
+
+    def close(self):
+        """Close idle stores now and checked-out stores when they are released."""
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, []
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for store, _ in idle:
+            self._discard(store)
+
+    def stats(self) -> dict:
+        """Pool size and counters."""
+        with self.condition:
+            return {
+                "size": self.size,
+                "idle": len(self.idle),
+                "in_use": self.size - len(self.idle),
+                "waiting": self.waiting,
+                "min_size": self.min_size,
+                "max_size": self.max_size,
+                "created": self.created,
+                "replaced": self.replaced,
+                "timeouts": self.timeouts,
+            }
@@ -0,0 +1,55 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+from EmbeddingCache import normalize_query
+
+
+class TranslationMemory:
+    """
+    Bounded, thread-safe LRU of query translations with a TTL, keyed by normalized
+    query text so repeats that differ only in case or spacing reuse the translation.
+    """
+
+    def __init__(self, max_size: int = 4096, ttl: float = 86400):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: "OrderedDict[str, tuple]" = OrderedDict()  # key -> (expires_at, translation)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text: str) -> Optional[str]:
+        """The remembered translation of text, or None."""
+        key = normalize_query(text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.hits += 1
+                    self.entries.move_to_end(key)
+                    return entry[1]
+                del self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, text: str, translation: str):
+        if self.max_size <= 0:
+            return
+        key = normalize_query(text)
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, translation)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        """Entry count and hit/miss counters."""
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
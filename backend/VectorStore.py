@@ -0,0 +1,145 @@
+import os
+import re
+import time
+import hashlib
+from typing import List, Dict, Any, Tuple
+
+from Rerank import get_reranker
+
+# Constant k in reciprocal rank fusion; larger values flatten the rank contribution
+RRF_K = int(os.environ.get("RRF_K", 60))
+
+# Words dropped from queries before keyword search, by query language
+STOP_WORDS = {
+    "English": {"a", "an", "the", "and", "or", "but", "is", "are", "in", "on", "at", "to", "for", "with"},
+    "Spanish": {"el", "la", "los", "las", "un", "una", "unos", "unas", "y", "o", "pero", "es", "son",
+                "en", "de", "del", "al", "a", "para", "por", "con", "que", "qué", "como", "cómo",
+                "mi", "su", "sus", "se", "lo", "le", "hay", "tiene", "tienen", "cuál", "cuáles"},
+}
+
+def content_hash(text: str) -> str:
+    """Stable SHA-256 of a chunk's text with whitespace normalized."""
+    normalized = " ".join(text.split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+def group_chunks_by_source(docs) -> Dict[str, Dict[str, Tuple[str, Dict]]]:
+    """
+    Group chunks by metadata['source'] and content hash, dropping duplicate chunks within a source.
+    docs is an iterable of Document objects or (content, metadata) pairs.
+    """
+    by_source: Dict[str, Dict[str, Tuple[str, Dict]]] = {}
+    for doc in docs:
+        if hasattr(doc, 'page_content'):
+            content, metadata = doc.page_content, doc.metadata
+        else:
+            content, metadata = doc
+        source = metadata.get("source") or ""
+        by_source.setdefault(source, {}).setdefault(content_hash(content), (content, metadata))
+    return by_source
+
+def reciprocal_rank_fusion(result_lists: List[List[Dict[str, Any]]], weights: List[float] = None,
+                           k: int = RRF_K) -> List[Dict[str, Any]]:
+    """
+    Merge ranked result lists with (weighted) reciprocal rank fusion.
+    Each document scores sum(weight / (k + rank)) over the lists it appears in;
+    results are keyed by id and returned best first with the fused "score".
+    """
+    if weights is None:
+        weights = [1.0] * len(result_lists)
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, doc in enumerate(results, start=1):
+            entry = fused.get(doc["id"])
+            if entry is None:
+                entry = fused[doc["id"]] = dict(doc, score=0.0)
+            entry["score"] += weight / (k + rank)
+    return sorted(fused.values(), key=lambda x: x["score"], reverse=True)
+
+class VectorStore:
+    """
+    Interface shared by the vector store backends: VectorDB (PostgreSQL + pgvector)
+    and NumpyVectorStore (embedded memory-mapped matrix).
+
+    Incremental ingestion is split into plan_sync (read-only, safe to run on another
+    thread while the previous file is written) and apply_sync (deletes stale chunks and
+    writes new chunks with pre-computed embeddings).
+    """
+
+    def add_documents(self, documents: List[str], metadatas: List[Dict] = None, **kwargs):
+        """Embed and store documents."""
+        raise NotImplementedError
+
+    def sync_documents(self, documents: List[str], metadatas: List[Dict] = None, **kwargs) -> Dict[str, int]:
+        """Store only new or changed chunks per source and drop stale ones."""
+        raise NotImplementedError
+
+    def plan_sync(self, docs) -> List[Dict[str, Any]]:
+        """Work out, per source, which chunks are new compared to what is stored."""
+        raise NotImplementedError
+
+    def apply_sync(self, plans: List[Dict[str, Any]], embeddings) -> Dict[str, int]:
+        """Apply a plan from plan_sync using embeddings for its new chunks, in plan order."""
+        raise NotImplementedError
+
+    def similarity_search(self, query: str, k: int = 5, **kwargs) -> List[Dict[str, Any]]:
+        """Return the top k documents for query as dicts with id, content, metadata and score."""
+        raise NotImplementedError
+
+    def part_number_search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Chunks mentioning a part number quoted in query, or [] if there are none."""
+        return []
+
+    def get_document_count(self) -> int:
+        """Get the total number of stored documents."""
+        raise NotImplementedError
+
+    def delete_documents(self, source: str) -> int:
+        """Delete every chunk of a source. Returns the number of chunks deleted."""
+        raise NotImplementedError
+
+    def ensure_vector_index(self):
+        """Build the search index after a bulk load if it is missing."""
+
+    def close(self):
+        """Release any resources held by the store."""
+
+    def is_connected(self) -> bool:
+        """Whether the store can still serve queries."""
+        return True
+
+    def _extract_keywords(self, query: str, language: str = "English") -> str:
+        """
+        Extract meaningful keywords from the query for text search.
+        Returns a formatted string for PostgreSQL ts_query.
+        """
+        start_time = time.time()
+        # Remove stop words and special characters
+        stop_words = STOP_WORDS.get(language, STOP_WORDS["English"])
+        words = re.findall(r'\b\w+\b', query.lower())
+        
+        # Filter out stop words and short terms
+        keywords = [word for word in words if word not in stop_words and len(word) > 2]
+        
+        if not keywords:
+            end_time = time.time()
+            print(f"TIMING: _extract_keywords took {end_time - start_time:.4f} seconds (no keywords found)")
+            return ""
+        
+        # Format for PostgreSQL tsquery (word1 | word2 | word3)
+        result = " | ".join(keywords)
+        end_time = time.time()
+        print(f"TIMING: _extract_keywords took {end_time - start_time:.4f} seconds")
+        return result
+
+    def _rerank_results(self, query: str, candidates: List[Dict[str, Any]],
+                        budget_ms: float = None, language: str = "English") -> List[Dict[str, Any]]:
+        """
+        Re-rank the candidate results with the configured reranking stage (see Rerank.py).
+        Keywords for the heuristic are extracted once for the whole candidate list.
+        """
+        start_time = time.time()
+        keywords = self._extract_keywords(query, language).split(" | ")
+        sorted_results = get_reranker().rerank(query, candidates, keywords, budget_ms=budget_ms)
+        end_time = time.time()
+        print(f"TIMING: _rerank_results took {end_time - start_time:.4f} seconds")
+        return sorted_results
@@ -1,259 +1,816 @@
 import psycopg2
+import psycopg2.extras
 import numpy as np
-import pandas as pd
 import os
 import re
 import json
-import glob
-from pathlib import Path
-from typing import List, Dict, Any, Tuple
-from sklearn.metrics.pairwise import cosine_similarity
+from typing import TYPE_CHECKING, List, Dict, Any, Tuple
 from dotenv import load_dotenv
-from langchain_docling.loader import ExportType
-from langchain_docling import DoclingLoader
-from docling.chunking import HybridChunker
-from sentence_transformers import SentenceTransformer
-import torch
-import datetime
+if TYPE_CHECKING:
+    from sentence_transformers import SentenceTransformer
+from EmbeddingCache import EmbeddingCache, QueryEmbeddingCache, normalize_query
+from EmbedBatcher import EmbeddingBatcher
+from VectorStore import VectorStore, content_hash, group_chunks_by_source, reciprocal_rank_fusion
+from PartNumbers import extract_part_numbers
+from Fitment import (FITMENT_MAKE_PATTERN, FITMENT_YEAR_PATTERN, FITMENT_MODEL_PATTERN, fitment_from_url,
+                     model_keys, parse_fitment_query)
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import io
+import csv
+import math
 
 # Load environment variables from .env file
 load_dotenv()
 POSTGRESPASS = os.environ.get("POSTGRESPASS")
 
-process_start = time.time()
-
 # Get the directory where this script is located
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
-DOC_LOAD_DIR = os.path.join(SCRIPT_DIR, "TempDocumentStore")
-CSV_FILE = os.path.join(SCRIPT_DIR, "discovered_links.csv")
 
 # Constants
 EMBED_MODEL_ID = "BAAI/bge-m3"
-EXPORT_TYPE = ExportType.DOC_CHUNKS
-
-# Create the chunker for document processing
-chunker = HybridChunker(
-    tokenizer=EMBED_MODEL_ID,
-    max_tokens=2000,
-    overlap_tokens=100,
-    split_by_paragraph=True,
-    min_tokens=50
-)
-
-def find_url(csv_file, document_name):
-    """
-    Search for a document name in a CSV file and return the corresponding URL.
-    
-    Parameters:
-    csv_file (str): Path to the CSV file.
-    document_name (str): The name of the document to search for.
-    
-    Returns:
-    str: The corresponding URL if found, otherwise None.
-    """
-    # Clean up the document name path
-    document_name = document_name.replace("c:\\Users\\RODDIXON\\Desktop\\FreedomRacing\\backend\\","")
-
-    try:
-        df = pd.read_csv(csv_file)
-        result = df.loc[df.iloc[:, 0] == document_name, df.columns[0]]
-        if result:
-            print(f"Found internet url in LamoniUrls.csv to {result}")
-        else:
-            print("No url found in LamoniUrls.csv")
-        return result.values[0] if not result.empty else None
-    except Exception as e:
-        print(f"Error: {e}")
-        return None
+EMBED_DIM = 1024
+
+# Restrict retrieval to catalog rows matching the make/year/model named in a question
+FITMENT_FILTER = os.environ.get("FITMENT_FILTER", "true").lower() == "true"
+# Seconds the distinct (make, model) list used to parse questions is reused
+FITMENT_CATALOG_TTL = float(os.environ.get("FITMENT_CATALOG_TTL", 300))
+
+# Answer questions quoting a part or tool number from the part_numbers table before
+# any embedding work; fuzzy matches need this pg_trgm similarity to the stored number
+PART_LOOKUP = os.environ.get("PART_LOOKUP", "true").lower() == "true"
+PART_FUZZY_THRESHOLD = float(os.environ.get("PART_FUZZY_THRESHOLD", 0.6))
+
+# Bulk ingestion settings
+EMBED_BATCH_SIZE = int(os.environ.get("EMBED_BATCH_SIZE", 32))
+COPY_BATCH_SIZE = int(os.environ.get("COPY_BATCH_SIZE", 500))
+
+# Persistent embedding cache shared by ingestion and queries (EMBED_CACHE_SIZE=0 disables it)
+EMBED_CACHE_DIR = os.environ.get("EMBED_CACHE_DIR", os.path.join(SCRIPT_DIR, "embedding_cache"))
+EMBED_CACHE_SIZE = int(os.environ.get("EMBED_CACHE_SIZE", 100000))
+EMBED_CACHE_DTYPE = os.environ.get("EMBED_CACHE_DTYPE", "float16")
+
+# In-memory cache of query embeddings keyed by normalized query text
+QUERY_CACHE_SIZE = int(os.environ.get("QUERY_CACHE_SIZE", 1024))
+QUERY_CACHE_TTL = float(os.environ.get("QUERY_CACHE_TTL", 3600))
+query_embedding_cache = QueryEmbeddingCache(max_size=QUERY_CACHE_SIZE, ttl=QUERY_CACHE_TTL)
+
+# Query embeddings from concurrent requests are encoded together: up to this many per
+# forward pass, waiting at most EMBED_QUERY_BATCH_WAIT_MS for company. 1 disables batching.
+EMBED_QUERY_BATCH_SIZE = int(os.environ.get("EMBED_QUERY_BATCH_SIZE", 16))
+EMBED_QUERY_BATCH_WAIT_MS = float(os.environ.get("EMBED_QUERY_BATCH_WAIT_MS", 5))
+
+# Approximate nearest neighbour index on documents.embedding ("hnsw" or "ivfflat").
+# Queries order by cosine distance (<=>) so the index uses the cosine operator class.
+VECTOR_INDEX_TYPE = os.environ.get("VECTOR_INDEX_TYPE", "hnsw")
+VECTOR_INDEX_NAME = "documents_embedding_idx"
+# Rebuild an ivfflat index after ingest once its lists are off from what the current
+# row count calls for by this factor (an index built after a small first load)
+IVFFLAT_LISTS_DRIFT = float(os.environ.get("IVFFLAT_LISTS_DRIFT", 2.0))
+HNSW_EF_SEARCH = int(os.environ.get("HNSW_EF_SEARCH", 100))
+IVFFLAT_PROBES = int(os.environ.get("IVFFLAT_PROBES", 10))
+
+# Representation the ANN index is built over. "full" indexes the float32 embedding;
+# "halfvec" (float16) and "binary" (1 bit per dimension, Hamming distance) index a
+# compact generated copy and rescore the top RESCORE_OVERSAMPLE * N candidates
+# against the full-precision embedding.
+VECTOR_STORAGE = os.environ.get("VECTOR_STORAGE", "full")
+RESCORE_OVERSAMPLE = int(os.environ.get("RESCORE_OVERSAMPLE", 4))
+# storage mode: (column, generated expression, operator class, distance operator, query cast)
+VECTOR_STORAGE_MODES = {
+    "full": ("embedding", None, "vector_cosine_ops", "<=>", "%s::vector"),
+    "halfvec": ("embedding_half", f"embedding::halfvec({EMBED_DIM})",
+                "halfvec_cosine_ops", "<=>", f"%s::halfvec({EMBED_DIM})"),
+    "binary": ("embedding_bin", f"binary_quantize(embedding)::bit({EMBED_DIM})",
+               "bit_hamming_ops", "<~>", f"binary_quantize(%s::vector)::bit({EMBED_DIM})"),
+}
 
-def process_file_type(files: List[str], file_type: str, category: str) -> List:
+# Hybrid retrieval: "fusion" runs ANN and full-text top-N queries concurrently and merges
+# them with reciprocal rank fusion; "weighted" is the original single-statement score sum.
+HYBRID_MODE = os.environ.get("HYBRID_MODE", "fusion")
+
+# Runs the vector and keyword halves of a fusion search side by side
+search_executor = ThreadPoolExecutor(max_workers=int(os.environ.get("SEARCH_THREADS", 8)))
+
+# Vector store backend: "pgvector" (PostgreSQL) or "numpy" (embedded memory-mapped matrix)
+VECTOR_BACKEND = os.environ.get("VECTOR_BACKEND", "pgvector")
+NUMPY_STORE_DIR = os.environ.get("NUMPY_STORE_DIR", os.path.join(SCRIPT_DIR, "vector_store"))
+NUMPY_INDEX = os.environ.get("NUMPY_INDEX", "exact")  # "exact" or "ivf"
+IVF_NPROBE = int(os.environ.get("IVF_NPROBE", 8))
+
+# Text search configuration for the query side of keyword search, by query language.
+# content_tsv is built with the english configuration, so a non-English query can only
+# match it on words both languages share (brands, models, part and model numbers);
+# "simple" keeps those as typed instead of stemming them with the wrong language's rules.
+FTS_QUERY_CONFIGS = {"English": "english", "Spanish": "simple"}
+
+# Weight chunk headings above body text in the stored full-text vector.
+# Only takes effect when the content_tsv column is first created.
+FTS_WEIGHT_HEADINGS = os.environ.get("FTS_WEIGHT_HEADINGS", "true").lower() == "true"
+
+embedding_model_lock = threading.Lock()
+
+def get_embedding_model() -> "SentenceTransformer":
     """
-    Process a specific file type and return document chunks.
-    This eliminates code duplication across different file types.
+    Load the BAAI/bge-m3 model once and cache it for the process. sentence_transformers
+    and torch are imported here: the package __init__ pulls in CrossEncoder and its
+    evaluators, and through them sklearn, which importing VectorTools shouldn't cost.
     """
-    all_splits = []
-    
-    for file in files:
-        print(f"Loading {file_type}: {Path(file).name}")
-        loader = DoclingLoader(
-            file_path=[file],
-            export_type=EXPORT_TYPE,
-            chunker=chunker,
-        )
-        docs = loader.load()
-
-        for doc in docs:
-            # Extract and clean metadata
-            source_file = None
-            headings = None
-            timestamp = datetime.datetime.now().isoformat()
-            
-            if hasattr(doc, 'metadata') and doc.metadata:
-                if 'source' in doc.metadata:
-                    source_file = doc.metadata['source']
-                
-                if 'dl_meta' in doc.metadata and 'headings' in doc.metadata['dl_meta']:
-                    headings = doc.metadata['dl_meta']['headings'][0] if doc.metadata['dl_meta']['headings'] else None
-            
-                # Clean up the source file path
-                source_file = source_file.replace("discovered_links.csv","")
-                print('workin')
-                print(source_file)
-                url = find_url(CSV_FILE, source_file)
-
-            # Replace the metadata with simplified version
-            doc.metadata = {
-                'source': source_file,
-                'heading': headings,
-                'scraped_at': timestamp,
-                "url": url,
-                "type": category
-            }
-
-        all_splits.extend(docs)
-    
-    return all_splits
+    if not hasattr(get_embedding_model, "model"):
+        # Startup warmup and the first queries may race to load it
+        with embedding_model_lock:
+            if not hasattr(get_embedding_model, "model"):
+                model_init_start = time.time()
+                import torch
+                from sentence_transformers import SentenceTransformer
+                # Specifically use the BAAI/bge-m3 model from HuggingFace
+                model = SentenceTransformer(EMBED_MODEL_ID)
 
-def process_documents(urlpath, category):
-    """Process and ingest documents into PGvectorstore"""
-    print("Starting document ingestion process...")
-    
-    # Define file types and their extensions
-    file_types = {
-        'PDF': glob.glob(os.path.join(urlpath, "*.pdf")),
-        'Markdown': glob.glob(os.path.join(urlpath, "*.md")),
-        'DOCX': glob.glob(os.path.join(urlpath, "*.docx")),
-        'CSV': glob.glob(os.path.join(urlpath, "*.csv")),
-        'text': glob.glob(os.path.join(urlpath, "*.txt")),
-        'HTML': glob.glob(os.path.join(urlpath, "*.html")),
-    }
-
-    print(f"Processing {len(file_types['PDF'])} PDFs, {len(file_types['Markdown'])} Markdown, "
-          f"{len(file_types['DOCX'])} DOCX, {len(file_types['CSV'])} CSV files, "
-          f"{len(file_types['text'])} Text, and {len(file_types['HTML'])} HTML"
-          )
-
-    # Process all file types using the unified function
-    all_splits = []
-    for file_type, files in file_types.items():
-        if files:  # Only process if files exist
-            splits = process_file_type(files, file_type, category)
-            all_splits.extend(splits)
-    
-    print(f"Total document chunks created: {len(all_splits)}")
-    return all_splits
+                # Move model to GPU if available
+                if torch.cuda.is_available():
+                    model = model.to(torch.device('cuda'))
+                get_embedding_model.model = model
+                model_init_end = time.time()
+                print(f"TIMING: Embedding model initialization took {model_init_end - model_init_start:.4f} seconds")
+    return get_embedding_model.model
+
+def warm_embedding_model():
+    """Load the embedding model and run one encode so the first query doesn't pay for either."""
+    start_time = time.time()
+    get_embedding_model().encode("warmup", normalize_embeddings=True, convert_to_numpy=True,
+                                 show_progress_bar=False)
+    get_embedding_cache()
+    end_time = time.time()
+    print(f"TIMING: Embedding model warmup took {end_time - start_time:.4f} seconds")
+
+def get_embedding_cache():
+    """Open the on-disk embedding cache once per process, or return None if disabled."""
+    if not hasattr(get_embedding_cache, "cache"):
+        get_embedding_cache.cache = None
+        if EMBED_CACHE_SIZE > 0:
+            try:
+                get_embedding_cache.cache = EmbeddingCache(
+                    EMBED_CACHE_DIR, EMBED_MODEL_ID, EMBED_DIM,
+                    capacity=EMBED_CACHE_SIZE, dtype=EMBED_CACHE_DTYPE
+                )
+            except Exception as e:
+                print(f"Warning: Could not open embedding cache: {e}")
+    return get_embedding_cache.cache
+
+def encode_query_batch(texts: List[str]) -> np.ndarray:
+    """Encode a batch of query texts in one forward pass."""
+    return get_embedding_model().encode(
+        texts,
+        batch_size=len(texts),
+        normalize_embeddings=True,
+        convert_to_numpy=True,
+        show_progress_bar=False
+    )
+
+def get_embedding_batcher():
+    """The process-wide query embedding batcher, or None if batching is disabled."""
+    if not hasattr(get_embedding_batcher, "batcher"):
+        get_embedding_batcher.batcher = None
+        if EMBED_QUERY_BATCH_SIZE > 1:
+            get_embedding_batcher.batcher = EmbeddingBatcher(
+                encode_query_batch, max_batch_size=EMBED_QUERY_BATCH_SIZE, max_wait_ms=EMBED_QUERY_BATCH_WAIT_MS
+            )
+    return get_embedding_batcher.batcher
 
 def get_embedding(text: str) -> List[float]:
     "Generate embedding for text using BAAI/bge-m3"
     print("Starting document embedding process...")
     start_time = time.time()
-    
-    # Initialize the model (only done once and cached)
-    if not hasattr(get_embedding, "model"):
-        model_init_start = time.time()
-        # Specifically use the BAAI/bge-m3 model from HuggingFace
-        get_embedding.model = SentenceTransformer(EMBED_MODEL_ID)
-        
-        # Move model to GPU if available
-        if torch.cuda.is_available():
-            get_embedding.model = get_embedding.model.to(torch.device('cuda'))
-        model_init_end = time.time()
-        print(f"TIMING: Embedding model initialization took {model_init_end - model_init_start:.4f} seconds")
-    
-    # Generate embedding
+
+    cache = get_embedding_cache()
+    if cache is not None:
+        cached = cache.get(text)
+        if cached is not None:
+            end_time = time.time()
+            print(f"TIMING: get_embedding cache hit took {end_time - start_time:.4f} seconds")
+            return cached.tolist()
+
+    # Generate embedding, batched with other requests' queries when batching is on
     # The SentenceTransformer library handles tokenization, encoding, and normalization
     encode_start = time.time()
-    embedding = get_embedding.model.encode(
-        text,
-        normalize_embeddings=True,  # Ensure vectors are normalized (important for BGE models)
-        convert_to_numpy=True,      # Convert to numpy array for efficiency
-        show_progress_bar=True 
-    )
+    batcher = get_embedding_batcher()
+    if batcher is not None:
+        embedding = batcher.embed(text)
+    else:
+        embedding = get_embedding_model().encode(
+            text,
+            normalize_embeddings=True,  # Ensure vectors are normalized (important for BGE models)
+            convert_to_numpy=True,      # Convert to numpy array for efficiency
+            show_progress_bar=False
+        )
     encode_end = time.time()
     print(f"TIMING: Text encoding took {encode_end - encode_start:.4f} seconds")
+
+    if cache is not None:
+        cache.put(text, embedding)
     
     # Convert to list and return
     end_time = time.time()
     print(f"TIMING: get_embedding took {end_time - start_time:.4f} seconds")
     return embedding.tolist()
 
-class VectorDB:
-    def __init__(self, conn_params: Dict[str, Any]):
-        """Initialize the vector database with connection parameters."""
+def get_query_embedding(query: str) -> List[float]:
+    """
+    Embedding for a search query, served from the in-memory query cache when possible.
+    Concurrent identical queries share one model call.
+    """
+    return query_embedding_cache.get_or_compute(normalize_query(query), lambda: get_embedding(query))
+
+def get_embeddings(texts: List[str], batch_size: int = EMBED_BATCH_SIZE) -> np.ndarray:
+    """
+    Generate embeddings for many texts in batches using BAAI/bge-m3.
+    Texts already in the embedding cache are not re-encoded.
+    Returns a float32 array of shape (len(texts), dim).
+    """
+    start_time = time.time()
+    embeddings = np.empty((len(texts), EMBED_DIM), dtype=np.float32)
+
+    cache = get_embedding_cache()
+    cached = cache.get_many(texts) if cache is not None else [None] * len(texts)
+    missing = []
+    for i, vector in enumerate(cached):
+        if vector is None:
+            missing.append(i)
+        else:
+            embeddings[i] = vector
+
+    if missing:
+        model = get_embedding_model()
+        missing_texts = [texts[i] for i in missing]
+        encoded = model.encode(
+            missing_texts,
+            batch_size=batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        embeddings[missing] = encoded
+        if cache is not None:
+            cache.put_many(missing_texts, encoded)
+            cache.flush()
+
+    end_time = time.time()
+    print(f"TIMING: get_embeddings encoded {len(missing)} of {len(texts)} texts "
+          f"({len(texts) - len(missing)} cached) in {end_time - start_time:.4f} seconds")
+    return embeddings
+
+def vector_index_params(index_type: str, row_count: int) -> Dict[str, int]:
+    """Index build parameters for the given index type sized to the table's row count."""
+    if index_type == "ivfflat":
+        # pgvector guidance: rows / 1000 lists up to 1M rows, sqrt(rows) beyond that
+        if row_count <= 1000000:
+            return {"lists": max(1, row_count // 1000)}
+        return {"lists": int(math.sqrt(row_count))}
+    if index_type == "hnsw":
+        if row_count < 100000:
+            return {"m": 16, "ef_construction": 64}
+        if row_count < 1000000:
+            return {"m": 16, "ef_construction": 128}
+        return {"m": 24, "ef_construction": 200}
+    raise ValueError(f"Unknown vector index type: {index_type}")
+
+def vector_literal(embedding) -> str:
+    """Format an embedding as a pgvector text literal, e.g. [0.1,0.2,...]."""
+    return "[" + ",".join("%.8g" % x for x in embedding) + "]"
+
+class VectorDB(VectorStore):
+    """Vector store backed by PostgreSQL with pgvector."""
+    def __init__(self, conn_params: Dict[str, Any], vector_storage: str = VECTOR_STORAGE, setup: bool = True):
+        """
+        Initialize the vector database with connection parameters.
+        setup=False skips the schema DDL in setup_database, for pooled query connections
+        opened after the schema was created at deploy time.
+        """
         start_time = time.time()
+        if vector_storage not in VECTOR_STORAGE_MODES:
+            raise ValueError(f"Unknown vector storage mode: {vector_storage}")
         self.conn_params = conn_params
+        self.vector_storage = vector_storage
         self.conn = psycopg2.connect(**conn_params)
-        self.setup_database()
+        # Second connection for reads that run alongside work on self.conn: the keyword
+        # half of a fusion search and ingest planning
+        self.read_conn = None
+        if setup:
+            try:
+                self.setup_database()
+            except Exception:
+                self.conn.close()
+                raise
         end_time = time.time()
         print(f"TIMING: VectorDB initialization took {end_time - start_time:.4f} seconds")
     
+    def _schema_steps(self) -> List[Tuple[str, List[Tuple[str, tuple]]]]:
+        """Schema setup as (name, [(sql, params), ...]) steps, each committed on its own."""
+        steps = []
+
+        # pgvector extension and the documents table
+        steps.append(("documents", [
+            ("CREATE EXTENSION IF NOT EXISTS vector;", None),
+            ("""
+            CREATE TABLE IF NOT EXISTS documents (
+                id SERIAL PRIMARY KEY,
+                content TEXT NOT NULL,
+                metadata JSONB,
+                embedding vector(1024)
+            );
+            """, None),
+        ]))
+
+        # Content hash used to skip unchanged chunks on re-ingest
+        steps.append(("content_hash", [
+            ("ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT;", None),
+            ("""
+            CREATE INDEX IF NOT EXISTS documents_source_hash_idx ON documents
+            ((metadata->>'source'), content_hash);
+            """, None),
+        ]))
+
+        # One row per ingested source recording what is currently stored for it
+        steps.append(("ingest_manifest", [
+            ("""
+            CREATE TABLE IF NOT EXISTS ingest_manifest (
+                source TEXT PRIMARY KEY,
+                url TEXT,
+                chunk_hashes TEXT[] NOT NULL,
+                model_id TEXT NOT NULL,
+                updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+            """, None),
+        ]))
+
+        # Full-text vector stored once per row instead of re-tokenized per query
+        if FTS_WEIGHT_HEADINGS:
+            tsv_expression = """
+            setweight(to_tsvector('english', coalesce(metadata->>'heading', '')), 'A') ||
+            setweight(to_tsvector('english', content), 'B')
+            """
+        else:
+            tsv_expression = "to_tsvector('english', content)"
+        steps.append(("content_tsv", [
+            (f"""
+            ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_tsv tsvector
+            GENERATED ALWAYS AS ({tsv_expression}) STORED;
+            """, None),
+            ("CREATE INDEX IF NOT EXISTS documents_content_tsv_idx ON documents USING gin (content_tsv);", None),
+        ]))
+
+        # Compact copy of the embedding for quantized ANN search
+        column, expression = VECTOR_STORAGE_MODES[self.vector_storage][:2]
+        if expression:
+            steps.append((column, [
+                (f"""
+                ALTER TABLE documents ADD COLUMN IF NOT EXISTS {column}
+                {"halfvec" if self.vector_storage == "halfvec" else "bit"}({EMBED_DIM})
+                GENERATED ALWAYS AS ({expression}) STORED;
+                """, None),
+            ]))
+
+        # Vehicle fitment parsed from catalog URLs (/<make>-parts/<year>/<model>.html),
+        # generated so existing rows are filled in without re-ingesting
+        fitment_statements = [
+            (f"""
+            ALTER TABLE documents ADD COLUMN IF NOT EXISTS {name} {sql_type}
+            GENERATED ALWAYS AS ((substring(metadata->>'url' from %s))::{sql_type}) STORED;
+            """, (pattern,))
+            for name, sql_type, pattern in (
+                ("fit_make", "TEXT", FITMENT_MAKE_PATTERN),
+                ("fit_year", "INTEGER", FITMENT_YEAR_PATTERN),
+                ("fit_model", "TEXT", FITMENT_MODEL_PATTERN),
+            )
+        ]
+        steps.append(("fitment", fitment_statements + [
+            ("CREATE INDEX IF NOT EXISTS documents_fitment_model_idx ON documents (fit_model, fit_year);", None),
+            ("CREATE INDEX IF NOT EXISTS documents_fitment_make_idx ON documents (fit_make, fit_year);", None),
+        ]))
+
+        # Part and tool numbers found in each chunk, normalized (see PartNumbers.py),
+        # with a btree for exact lookups and a trigram index for near misses
+        steps.append(("part_numbers", [
+            ("CREATE EXTENSION IF NOT EXISTS pg_trgm;", None),
+            ("""
+            CREATE TABLE IF NOT EXISTS part_numbers (
+                part_key TEXT NOT NULL,
+                part_number TEXT NOT NULL,
+                document_id INTEGER NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+                PRIMARY KEY (part_key, document_id)
+            );
+            """, None),
+            ("CREATE INDEX IF NOT EXISTS part_numbers_document_idx ON part_numbers (document_id);", None),
+            ("""
+            CREATE INDEX IF NOT EXISTS part_numbers_key_trgm_idx ON part_numbers
+            USING gin (part_key gin_trgm_ops);
+            """, None),
+        ]))
+
+        # The original ivfflat index used vector_l2_ops and was built on an empty
+        # table, so cosine queries never used it. Vector indexes are now built
+        # after loading data with build_vector_index().
+        steps.append(("drop_legacy_index", [("DROP INDEX IF EXISTS embedding_idx;", None)]))
+        return steps
+
     def setup_database(self):
-        """Set up the necessary database tables and extensions."""
+        """
+        Set up the necessary database tables and extensions. Each step commits on its own,
+        so a failing step (a missing extension, say) doesn't undo the others; the failures
+        are raised together once every step has been tried.
+        """
         start_time = time.time()
-        with self.conn.cursor() as cursor:
+        failed = []
+        for name, statements in self._schema_steps():
             try:
-                # Create pgvector extension if it doesn't exist
-                cursor.execute("""
-                CREATE EXTENSION IF NOT EXISTS vector;
-                """)
-                
-                # Create documents table if it doesn't exist
-                cursor.execute("""
-                CREATE TABLE IF NOT EXISTS documents (
-                    id SERIAL PRIMARY KEY,
-                    content TEXT NOT NULL,
-                    metadata JSONB,
-                    embedding vector(1024)
-                );
-                """)
-                
-                # Try to create an index for faster similarity search
-                try:
-                    cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS embedding_idx ON documents 
-                    USING ivfflat (embedding vector_l2_ops)
-                    WITH (lists = 100);
-                    """)
-                except Exception as e:
-                    print(f"Warning: Could not create IVFFlat index: {e}")
-                    print("Creating simple L2 index instead...")
-                    cursor.execute("""
-                    CREATE INDEX IF NOT EXISTS embedding_idx ON documents 
-                    USING btree (embedding);
-                    """)
-                
+                with self.conn.cursor() as cursor:
+                    for sql, params in statements:
+                        cursor.execute(sql, params)
                 self.conn.commit()
             except Exception as e:
-                print(f"Database setup error: {e}")
-                print("If the pgvector extension is not available, please install it first.")
                 self.conn.rollback()
+                print(f"Database setup error in step {name}: {e}")
+                failed.append(f"{name}: {e}")
         end_time = time.time()
         print(f"TIMING: Database setup took {end_time - start_time:.4f} seconds")
+        if failed:
+            raise RuntimeError("Database setup failed (is the pgvector extension installed?): "
+                               + "; ".join(failed))
     
-    def add_documents(self, documents: List[str], metadatas: List[Dict] = None):
-        """Add documents and their embeddings to the database."""
+    def add_documents(self, documents: List[str], metadatas: List[Dict] = None,
+                      batch_size: int = EMBED_BATCH_SIZE, copy_batch_size: int = COPY_BATCH_SIZE):
+        """
+        Add documents and their embeddings to the database.
+        Chunks are encoded batch_size at a time and streamed into Postgres with COPY,
+        committing every copy_batch_size rows so a failure only loses the open batch.
+        """
         if metadatas is None:
             metadatas = [{}] * len(documents)
-        
+
+        start_time = time.time()
+        total = len(documents)
+        for batch_start in range(0, total, copy_batch_size):
+            batch_docs = documents[batch_start:batch_start + copy_batch_size]
+            batch_metas = metadatas[batch_start:batch_start + copy_batch_size]
+            embeddings = get_embeddings(batch_docs, batch_size=batch_size)
+            self._copy_rows(batch_docs, batch_metas, embeddings)
+            print(f"Inserted {min(batch_start + copy_batch_size, total)}/{total} documents")
+
+        end_time = time.time()
+        print(f"TIMING: add_documents inserted {total} documents in {end_time - start_time:.4f} seconds")
+
+    def sync_documents(self, documents: List[str], metadatas: List[Dict] = None,
+                       batch_size: int = EMBED_BATCH_SIZE, copy_batch_size: int = COPY_BATCH_SIZE) -> Dict[str, int]:
+        """
+        Incrementally ingest documents grouped by metadata['source'].
+        Only chunks whose content hash is not already stored for that source are embedded
+        and inserted; stored chunks that are no longer present are deleted. A source whose
+        manifest was built with a different embedding model is re-embedded from scratch.
+        Returns counts of inserted, deleted and unchanged chunks.
+        """
+        if metadatas is None:
+            metadatas = [{}] * len(documents)
+
+        start_time = time.time()
+        plans = self.plan_sync(zip(documents, metadatas))
+
+        stats = {"inserted": 0, "deleted": 0, "unchanged": 0}
+        new_docs, new_metas = [], []
         with self.conn.cursor() as cursor:
-            for doc, metadata in zip(documents, metadatas):
-                embedding = get_embedding(doc)
-                # Format the embedding as a PostgreSQL vector using the proper format
-                embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
-                
+            for plan in plans:
+                stats["deleted"] += self._apply_source_plan(cursor, plan)
+                stats["unchanged"] += plan["unchanged"]
+                for doc, metadata in plan["new"]:
+                    new_docs.append(doc)
+                    new_metas.append(metadata)
+        self.conn.commit()
+
+        if new_docs:
+            self.add_documents(new_docs, new_metas, batch_size=batch_size, copy_batch_size=copy_batch_size)
+        stats["inserted"] = len(new_docs)
+
+        end_time = time.time()
+        print(f"Sync complete: {stats['inserted']} inserted, {stats['deleted']} deleted, "
+              f"{stats['unchanged']} unchanged across {len(plans)} sources")
+        print(f"TIMING: sync_documents took {end_time - start_time:.4f} seconds")
+        return stats
+
+    def plan_sync(self, docs) -> List[Dict[str, Any]]:
+        """
+        Work out, per source, which chunks are new compared to what is stored.
+        docs is an iterable of Document objects or (content, metadata) pairs.
+        Only reads, on the secondary connection, so it can overlap writes on self.conn.
+        """
+        by_source = group_chunks_by_source(docs)
+        conn = self._get_read_conn()
+        plans = []
+        try:
+            with conn.cursor() as cursor:
+                for source, chunks in by_source.items():
+                    cursor.execute(
+                        "SELECT model_id FROM ingest_manifest WHERE source = %s",
+                        (source,)
+                    )
+                    row = cursor.fetchone()
+                    # Embeddings from another model are not comparable - start over
+                    model_changed = row is not None and row[0] != EMBED_MODEL_ID
+                    stored = set()
+                    if not model_changed:
+                        cursor.execute(
+                            "SELECT content_hash FROM documents WHERE metadata->>'source' = %s",
+                            (source,)
+                        )
+                        stored = {r[0] for r in cursor.fetchall()}
+
+                    plans.append({
+                        "source": source,
+                        "hashes": list(chunks),
+                        "url": next((m.get("url") for _, m in chunks.values() if m.get("url")), None),
+                        "model_changed": model_changed,
+                        "has_stale": bool(stored - set(chunks)),
+                        "new": [pair for chunk_hash, pair in chunks.items() if chunk_hash not in stored],
+                        "unchanged": sum(1 for chunk_hash in chunks if chunk_hash in stored),
+                    })
+        finally:
+            conn.rollback()
+        return plans
+
+    def _apply_source_plan(self, cursor, plan: Dict[str, Any]) -> int:
+        """Delete stale rows for a planned source and update its manifest. Returns rows deleted."""
+        source = plan["source"]
+        deleted = 0
+        if plan["model_changed"]:
+            cursor.execute("DELETE FROM documents WHERE metadata->>'source' = %s", (source,))
+            deleted += cursor.rowcount
+        elif plan["has_stale"]:
+            # Drop chunks that are no longer part of this source, including
+            # rows stored before content hashing existed
+            cursor.execute(
+                """
+                DELETE FROM documents
+                WHERE metadata->>'source' = %s
+                AND (content_hash IS NULL OR NOT (content_hash = ANY(%s)))
+                """,
+                (source, plan["hashes"])
+            )
+            deleted += cursor.rowcount
+
+        # Collapse duplicates left behind by earlier non-incremental ingests
+        cursor.execute(
+            """
+            DELETE FROM documents a USING documents b
+            WHERE a.metadata->>'source' = %s AND b.metadata->>'source' = %s
+            AND a.content_hash = b.content_hash AND a.id > b.id
+            """,
+            (source, source)
+        )
+        deleted += cursor.rowcount
+
+        cursor.execute(
+            """
+            INSERT INTO ingest_manifest (source, url, chunk_hashes, model_id, updated_at)
+            VALUES (%s, %s, %s, %s, NOW())
+            ON CONFLICT (source) DO UPDATE
+            SET url = EXCLUDED.url, chunk_hashes = EXCLUDED.chunk_hashes,
+                model_id = EXCLUDED.model_id, updated_at = EXCLUDED.updated_at
+            """,
+            (source, plan["url"], plan["hashes"], EMBED_MODEL_ID)
+        )
+        return deleted
+
+    def apply_sync(self, plans: List[Dict[str, Any]], embeddings) -> Dict[str, int]:
+        """Apply planned deletes and insert pre-computed embeddings for new chunks in one transaction."""
+        stats = {"inserted": 0, "deleted": 0, "unchanged": 0}
+        new_docs, new_metas = [], []
+        try:
+            with self.conn.cursor() as cursor:
+                for plan in plans:
+                    stats["deleted"] += self._apply_source_plan(cursor, plan)
+                    stats["unchanged"] += plan["unchanged"]
+                    for doc, metadata in plan["new"]:
+                        new_docs.append(doc)
+                        new_metas.append(metadata)
+        except Exception:
+            self.conn.rollback()
+            raise
+
+        if new_docs:
+            # _copy_rows commits the deletes together with the inserts
+            self._copy_rows(new_docs, new_metas, embeddings)
+        else:
+            self.conn.commit()
+        stats["inserted"] = len(new_docs)
+        return stats
+
+    def _copy_rows(self, documents: List[str], metadatas: List[Dict], embeddings):
+        """Stream one batch of rows into the documents table with COPY and commit it."""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for doc, metadata, embedding in zip(documents, metadatas, embeddings):
+            writer.writerow([doc, json.dumps(metadata), vector_literal(embedding), content_hash(doc)])
+        buffer.seek(0)
+
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.copy_expert(
+                    "COPY documents (content, metadata, embedding, content_hash) FROM STDIN WITH (FORMAT csv)",
+                    buffer
+                )
+                self._index_part_numbers(cursor, documents, metadatas)
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+    
+    def _index_part_numbers(self, cursor, documents: List[str], metadatas: List[Dict]):
+        """Record the part numbers in freshly copied rows, found by (source, content_hash)."""
+        sources, hashes, keys, part_numbers = [], [], [], []
+        exclude = model_keys(self.get_fitment_catalog(cursor))
+        for doc, metadata in zip(documents, metadatas):
+            text = f"{metadata.get('heading') or ''}\n{doc}"
+            for key, part_number in extract_part_numbers(text, exclude=exclude | model_keys([], metadata.get("url"))):
+                sources.append(metadata.get("source"))
+                hashes.append(content_hash(doc))
+                keys.append(key)
+                part_numbers.append(part_number)
+        if not keys:
+            return
+        cursor.execute(
+            """
+            INSERT INTO part_numbers (part_key, part_number, document_id)
+            SELECT p.part_key, p.part_number, d.id
+            FROM unnest(%s::text[], %s::text[], %s::text[], %s::text[])
+                AS p(source, content_hash, part_key, part_number)
+            JOIN documents d ON d.metadata->>'source' = p.source AND d.content_hash = p.content_hash
+            ON CONFLICT DO NOTHING
+            """,
+            (sources, hashes, keys, part_numbers)
+        )
+
+    def backfill_part_numbers(self, batch_size: int = COPY_BATCH_SIZE) -> int:
+        """Extract part numbers for rows stored before the part_numbers table existed."""
+        start_time = time.time()
+        last_id, total = 0, 0
+        exclude = model_keys(self.get_fitment_catalog())
+        while True:
+            with self.conn.cursor() as cursor:
                 cursor.execute(
                     """
-                    INSERT INTO documents (content, metadata, embedding)
-                    VALUES (%s, %s, %s::vector)
-                    RETURNING id
+                    SELECT id, content, metadata->>'heading', metadata->>'url' FROM documents d
+                    WHERE id > %s AND NOT EXISTS (SELECT 1 FROM part_numbers p WHERE p.document_id = d.id)
+                    ORDER BY id
+                    LIMIT %s
                     """,
-                    (doc, json.dumps(metadata), embedding_str)
+                    (last_id, batch_size)
                 )
-            
+                rows = cursor.fetchall()
+                if not rows:
+                    break
+                values = [
+                    (key, part_number, doc_id)
+                    for doc_id, content, heading, url in rows
+                    for key, part_number in extract_part_numbers(
+                        f"{heading or ''}\n{content}", exclude=exclude | model_keys([], url)
+                    )
+                ]
+                if values:
+                    psycopg2.extras.execute_values(
+                        cursor,
+                        "INSERT INTO part_numbers (part_key, part_number, document_id) VALUES %s ON CONFLICT DO NOTHING",
+                        values
+                    )
+                total += len(values)
+                last_id = rows[-1][0]
             self.conn.commit()
-    
-    def similarity_search(self, query: str, k: int = 5, hybrid_ratio: float = 0.5) -> List[Dict[str, Any]]:
+        end_time = time.time()
+        print(f"TIMING: backfill_part_numbers indexed {total} part numbers in {end_time - start_time:.4f} seconds")
+        return total
+
+    def part_number_search(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """
+        Chunks mentioning a part number quoted in query: exact normalized matches first,
+        otherwise trigram matches above PART_FUZZY_THRESHOLD. Returns [] if the query has
+        no part numbers or nothing matches.
+        """
+        keys = [key for key, _ in extract_part_numbers(query, query=True,
+                                                       exclude=model_keys(self.get_fitment_catalog()))]
+        if not keys:
+            return []
+        start_time = time.time()
+        results = self._fetch_candidates(
+            self.conn,
+            """
+            SELECT d.id, d.content, d.metadata, count(*)::float as score
+            FROM part_numbers p JOIN documents d ON d.id = p.document_id
+            WHERE p.part_key = ANY(%s)
+            GROUP BY d.id
+            ORDER BY score DESC, d.id
+            LIMIT %s
+            """,
+            (keys, k)
+        )
+        match = "exact"
+        if not results:
+            match = "fuzzy"
+            results = self._fetch_candidates(
+                self.conn,
+                """
+                SELECT d.id, d.content, d.metadata, max(similarity(p.part_key, q.key)) as score
+                FROM unnest(%s::text[]) q(key)
+                JOIN part_numbers p ON p.part_key %% q.key
+                JOIN documents d ON d.id = p.document_id
+                GROUP BY d.id
+                ORDER BY score DESC, d.id
+                LIMIT %s
+                """,
+                (keys, k),
+                {"pg_trgm.similarity_threshold": PART_FUZZY_THRESHOLD}
+            )
+        end_time = time.time()
+        print(f"TIMING: Part number lookup ({match}, {len(results)} hits) for {keys} "
+              f"took {end_time - start_time:.4f} seconds")
+        return results
+
+    def get_vector_index(self):
+        """Return the (name, definition) of the embedding ANN index, or None if it doesn't exist."""
+        with self.conn.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = 'documents' AND indexname = %s",
+                (VECTOR_INDEX_NAME,)
+            )
+            return cursor.fetchone()
+
+    def build_vector_index(self, index_type: str = VECTOR_INDEX_TYPE, concurrently: bool = False):
+        """
+        (Re)build the embedding ANN index with parameters derived from the current row count.
+        With concurrently=True the new index is built alongside the old one and swapped in,
+        so searches keep using the old index until the new one is ready.
+        """
+        start_time = time.time()
+        row_count = self.get_document_count()
+        params = vector_index_params(index_type, row_count)
+        with_clause = ", ".join(f"{key} = {int(value)}" for key, value in params.items())
+        build_name = VECTOR_INDEX_NAME + "_new" if concurrently else VECTOR_INDEX_NAME
+        column, _, opclass = VECTOR_STORAGE_MODES[self.vector_storage][:3]
+        create_sql = f"""
+            CREATE INDEX {"CONCURRENTLY" if concurrently else ""} {build_name} ON documents
+            USING {index_type} ({column} {opclass})
+            WITH ({with_clause})
+        """
+        print(f"Building {index_type} index on {column} over {row_count} rows with {params}")
+
+        # CONCURRENTLY can't run inside a transaction block
+        self.conn.commit()
+        previous_autocommit = self.conn.autocommit
+        self.conn.autocommit = concurrently
+        try:
+            with self.conn.cursor() as cursor:
+                if concurrently:
+                    # Clean up an invalid index left behind by an interrupted rebuild
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {build_name}")
+                    cursor.execute(create_sql)
+                    cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {VECTOR_INDEX_NAME}")
+                    cursor.execute(f"ALTER INDEX {build_name} RENAME TO {VECTOR_INDEX_NAME}")
+                else:
+                    cursor.execute(f"DROP INDEX IF EXISTS {VECTOR_INDEX_NAME}")
+                    cursor.execute(create_sql)
+            if not concurrently:
+                self.conn.commit()
+        except Exception:
+            if not concurrently:
+                self.conn.rollback()
+            raise
+        finally:
+            self.conn.autocommit = previous_autocommit
+        end_time = time.time()
+        print(f"TIMING: build_vector_index took {end_time - start_time:.4f} seconds")
+
+    def ensure_vector_index(self, index_type: str = VECTOR_INDEX_TYPE):
+        """
+        Build the embedding ANN index after a bulk load if the table has rows but no index.
+        An ivfflat index whose lists have drifted IVFFLAT_LISTS_DRIFT-fold from what the
+        current row count calls for is rebuilt concurrently, so searches keep using it meanwhile.
+        """
+        row_count = self.get_document_count()
+        index = self.get_vector_index()
+        if index is None:
+            if row_count > 0:
+                self.build_vector_index(index_type)
+            return
+        match = re.search(r"USING ivfflat .*lists\s*=\s*'?(\d+)", index[1])
+        if match is None:
+            return
+        lists = int(match.group(1))
+        wanted = vector_index_params("ivfflat", row_count)["lists"]
+        if max(lists, wanted) >= IVFFLAT_LISTS_DRIFT * min(lists, wanted):
+            print(f"ivfflat index has {lists} lists but {row_count} rows call for {wanted}; rebuilding")
+            self.build_vector_index("ivfflat", concurrently=True)
+
+    def similarity_search(self, query: str, k: int = 5, hybrid_ratio: float = 0.5,
+                          ef_search: int = None, probes: int = None, mode: str = HYBRID_MODE,
+                          rerank_budget_ms: float = None, fitment_filter: bool = FITMENT_FILTER,
+                          part_lookup: bool = PART_LOOKUP, language: str = "English") -> List[Dict[str, Any]]:
         """
         Perform hybrid similarity search (vector + BM25-like) to find documents similar to the query.
         Returns the top k most similar documents after re-ranking.
@@ -262,80 +819,53 @@ class VectorDB:
             query: The query string
             k: The number of results to return
             hybrid_ratio: Balance between vector and keyword search (0.0 = all keyword, 1.0 = all vector)
+            ef_search: HNSW candidate list size for this query (defaults to HNSW_EF_SEARCH)
+            probes: IVFFlat lists to probe for this query (defaults to IVFFLAT_PROBES)
+            mode: "fusion" (concurrent ANN + full-text, rank fused) or "weighted" (single SQL score sum)
+            rerank_budget_ms: Time allowed for the cross-encoder reranker (defaults to RERANK_BUDGET_MS)
+            fitment_filter: Narrow catalog rows to the make/year/model named in the query;
+                pages that aren't catalog pages (FAQs, policies) are always searched
+            part_lookup: Return the chunks for a part number quoted in the query without searching
+            language: Language of the query text, which picks the keyword stop words and text
+                search configuration (the embedding model is multilingual)
         """
         start_time = time.time()
+        if part_lookup:
+            part_results = self.part_number_search(query, k)
+            if part_results:
+                return part_results
+
         # Get vector embedding
         embed_start = time.time()
-        query_embedding = get_embedding(query)
+        query_embedding = get_query_embedding(query)
         embed_end = time.time()
         print(f"TIMING: Query embedding generation took {embed_end - embed_start:.4f} seconds")
         
         # Prepare query for keyword search - extract meaningful terms
         keyword_start = time.time()
-        keywords = self._extract_keywords(query)
+        keywords = self._extract_keywords(query, language)
+        text_config = FTS_QUERY_CONFIGS.get(language, "simple")
         keyword_end = time.time()
         print(f"TIMING: Keyword extraction took {keyword_end - keyword_start:.4f} seconds")
+
+        # Format the query embedding as a PostgreSQL vector
+        query_embedding_str = vector_literal(query_embedding)
         
-        keyword_clause = ""
-        
-        if keywords:
-            # Create a text search query with weights for keyword matching
-            keyword_clause = "ts_rank(to_tsvector('english', content), to_tsquery('english', %s)) * (1 - %s) +"
-        
+        fitment = self.parse_fitment(query) if fitment_filter else None
+
         db_query_start = time.time()
-        with self.conn.cursor() as cursor:
-            # Format the query embedding as a PostgreSQL vector
-            query_embedding_str = "[" + ",".join(str(x) for x in query_embedding) + "]"
-            
-            sql_query = f"""
-            SELECT id, content, metadata, 
-                {keyword_clause if keywords else ""} (1 - (embedding <=> %s::vector)) * %s as hybrid_score
-            FROM documents
-            WHERE 1=1
-            """
-            
-            # Add keyword filter for first-stage retrieval if we have keywords
-            # This helps narrow down candidates before vector similarity
-            if keywords:
-                sql_query += " AND to_tsvector('english', content) @@ to_tsquery('english', %s)"
-                
-            sql_query += """
-            ORDER BY hybrid_score DESC
-            LIMIT %s * 5
-            """
-            
-            # Prepare parameters
-            params = []
-            if keywords:
-                params.extend([keywords, hybrid_ratio])
-            params.extend([query_embedding_str, hybrid_ratio if keywords else 1.0])
-            if keywords:
-                params.append(keywords)
-            params.append(k)
-            
-            sql_exec_start = time.time()
-            cursor.execute(sql_query, tuple(params))
-            sql_exec_end = time.time()
-            print(f"TIMING: SQL execution took {sql_exec_end - sql_exec_start:.4f} seconds")
-            
-            # First-stage retrieval results
-            fetch_start = time.time()
-            candidates = []
-            for doc_id, content, metadata, score in cursor.fetchall():
-                candidates.append({
-                    "id": doc_id,
-                    "content": content,
-                    "metadata": metadata,
-                    "score": score
-                })
-            fetch_end = time.time()
-            print(f"TIMING: Result fetching took {fetch_end - fetch_start:.4f} seconds")
+        candidates = self._search_candidates(mode, query_embedding_str, keywords, k * 5, hybrid_ratio,
+                                             ef_search, probes, fitment, text_config)
+        if fitment and not any(fitment_from_url((c["metadata"] or {}).get("url")) for c in candidates):
+            print(f"DEBUG: No catalog rows match fitment {fitment}, searching all documents")
+            candidates = self._search_candidates(mode, query_embedding_str, keywords, k * 5, hybrid_ratio,
+                                                 ef_search, probes, text_config=text_config)
         db_query_end = time.time()
         print(f"TIMING: Database query total took {db_query_end - db_query_start:.4f} seconds")
         
-        # Perform re-ranking using cross-encoder scoring or more detailed similarity
+        # Perform re-ranking using cross-encoder scoring or the keyword heuristic
         rerank_start = time.time()
-        reranked_results = self._rerank_results(query, candidates)
+        reranked_results = self._rerank_results(query, candidates, budget_ms=rerank_budget_ms, language=language)
         rerank_end = time.time()
         print(f"TIMING: Result re-ranking took {rerank_end - rerank_start:.4f} seconds")
         
@@ -345,63 +875,243 @@ class VectorDB:
         # Return top-k after re-ranking
         return reranked_results[:k]
 
-    def _extract_keywords(self, query: str) -> str:
+    def _search_candidates(self, mode: str, query_embedding_str: str, keywords: str, limit: int,
+                           hybrid_ratio: float, ef_search: int = None, probes: int = None,
+                           fitment: Dict[str, List] = None,
+                           text_config: str = "english") -> List[Dict[str, Any]]:
+        """Candidate retrieval for similarity_search in the given hybrid mode."""
+        if mode == "fusion":
+            return self._fusion_candidates(query_embedding_str, keywords, limit, hybrid_ratio,
+                                           ef_search, probes, fitment, text_config)
+        return self._weighted_candidates(query_embedding_str, keywords, limit, hybrid_ratio,
+                                         ef_search, probes, fitment, text_config)
+
+    def get_fitment_catalog(self, cursor=None) -> List[Tuple[str, str]]:
         """
-        Extract meaningful keywords from the query for text search.
-        Returns a formatted string for PostgreSQL ts_query.
+        Distinct (make, model) pairs in the catalog, cached for FITMENT_CATALOG_TTL seconds.
+        The write path passes its cursor so the read joins its open transaction; otherwise
+        it runs on self.conn and ends the read transaction. read_conn is left to plan_sync,
+        which the ingest embed stage runs on another thread.
         """
-        start_time = time.time()
-        # Remove stop words and special characters
-        stop_words = {"a", "an", "the", "and", "or", "but", "is", "are", "in", "on", "at", "to", "for", "with"}
-        words = re.findall(r'\b\w+\b', query.lower())
-        
-        # Filter out stop words and short terms
-        keywords = [word for word in words if word not in stop_words and len(word) > 2]
-        
-        if not keywords:
-            end_time = time.time()
-            print(f"TIMING: _extract_keywords took {end_time - start_time:.4f} seconds (no keywords found)")
-            return ""
-        
-        # Format for PostgreSQL tsquery (word1 | word2 | word3)
-        result = " | ".join(keywords)
-        end_time = time.time()
-        print(f"TIMING: _extract_keywords took {end_time - start_time:.4f} seconds")
-        return result
+        now = time.monotonic()
+        cached = getattr(self, "_fitment_catalog", None)
+        if cached is not None and cached[0] > now:
+            return cached[1]
+        sql_query = "SELECT DISTINCT fit_make, fit_model FROM documents WHERE fit_model IS NOT NULL"
+        if cursor is not None:
+            cursor.execute(sql_query)
+            catalog = cursor.fetchall()
+        else:
+            try:
+                with self.conn.cursor() as own_cursor:
+                    own_cursor.execute(sql_query)
+                    catalog = own_cursor.fetchall()
+            finally:
+                self.conn.rollback()
+        self._fitment_catalog = (now + FITMENT_CATALOG_TTL, catalog)
+        return catalog
+
+    def parse_fitment(self, query: str) -> Dict[str, List]:
+        """Make/year/model filter for query, or None if it doesn't name a vehicle."""
+        try:
+            fitment = parse_fitment_query(query, self.get_fitment_catalog())
+        except Exception as e:
+            print(f"Error parsing fitment: {e}")
+            return None
+        if fitment:
+            print(f"DEBUG: Fitment filter {fitment}")
+        return fitment
 
-    def _rerank_results(self, query: str, candidates: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    @staticmethod
+    def _fitment_where(fitment: Dict[str, List] = None, general: bool = True) -> Tuple[str, List]:
         """
-        Re-rank the candidate results using a more sophisticated scoring method.
-        This could use a cross-encoder or more detailed similarity calculation.
+        SQL condition (served by the fitment indexes) and parameters for a fitment filter.
+        Rows without fitment (pages outside the catalog) still match unless general is False.
         """
-        start_time = time.time()
-        # For BAAI/bge-m3, ideally you would use a cross-encoder here
-        # But as a simple implementation, we can use a combination of:
-        # 1. Exact phrase match bonus
-        # 2. Keyword density
-        # 3. Original hybrid score
-        
-        for doc in candidates:
-            content = doc["content"].lower()
-            query_lower = query.lower()
-            
-            # Exact phrase match bonus (1.5x boost if exact query appears)
-            exact_match_bonus = 1.5 if query_lower in content else 1.0
-            
-            # Keyword density check
-            keywords = self._extract_keywords(query).split(" | ")
-            keyword_count = sum(1 for keyword in keywords if keyword in content)
-            keyword_density = keyword_count / len(keywords) if keywords else 0
-            
-            # Compute final score - original score plus bonuses
-            final_score = doc["score"] * exact_match_bonus * (1 + keyword_density * 0.5)
-            doc["final_score"] = final_score
-        
-        # Sort by final score
-        sorted_results = sorted(candidates, key=lambda x: x.get("final_score", 0), reverse=True)
-        end_time = time.time()
-        print(f"TIMING: _rerank_results took {end_time - start_time:.4f} seconds")
-        return sorted_results
+        if not fitment:
+            return "TRUE", []
+        conditions, params = [], []
+        for column, key in (("fit_make", "makes"), ("fit_year", "years"), ("fit_model", "models")):
+            if fitment[key]:
+                conditions.append(f"{column} = ANY(%s)")
+                params.append(fitment[key])
+        where = " AND ".join(conditions)
+        if general:
+            where = f"(fit_make IS NULL OR ({where}))"
+        return where, params
+
+    def _fetch_candidates(self, conn, sql_query: str, params, settings: Dict[str, int] = None) -> List[Dict[str, Any]]:
+        """Run a candidate query on conn and return rows as dicts, ending the read transaction."""
+        try:
+            with conn.cursor() as cursor:
+                # Per-query ANN recall/latency knobs, scoped to this transaction
+                for name, value in (settings or {}).items():
+                    cursor.execute(f"SET LOCAL {name} = %s", (value,))
+                cursor.execute(sql_query, tuple(params))
+                return [
+                    {"id": doc_id, "content": content, "metadata": metadata, "score": score}
+                    for doc_id, content, metadata, score in cursor.fetchall()
+                ]
+        finally:
+            conn.rollback()
+
+    def _ann_settings(self, ef_search: int = None, probes: int = None) -> Dict[str, int]:
+        """SET LOCAL values for the ANN index, falling back to the configured defaults."""
+        return {
+            "hnsw.ef_search": ef_search or HNSW_EF_SEARCH,
+            "ivfflat.probes": probes or IVFFLAT_PROBES,
+        }
+
+    def _vector_candidates(self, conn, query_embedding_str: str, limit: int,
+                           ef_search: int = None, probes: int = None,
+                           fitment: Dict[str, List] = None) -> List[Dict[str, Any]]:
+        """
+        ANN top-N by cosine distance; ordering by the raw distance lets the index serve it.
+        With quantized storage the index is searched for RESCORE_OVERSAMPLE * N candidates
+        which are then re-ordered by full-precision cosine distance.
+        With a fitment filter the matching catalog rows are selected through the fitment
+        indexes first and scored exactly, so the ANN index can't drop them; rows outside
+        the catalog come from the ANN index as usual and the two sets are merged by score.
+        """
+        column, _, _, operator, query_cast = VECTOR_STORAGE_MODES[self.vector_storage]
+        sql_exec_start = time.time()
+        if fitment:
+            where, where_params = self._fitment_where(fitment, general=False)
+            sql_query = f"""
+            WITH fitment_rows AS MATERIALIZED (
+                SELECT id, content, metadata, embedding
+                FROM documents
+                WHERE {where}
+            )
+            SELECT id, content, metadata, score FROM (
+                (SELECT id, content, metadata, 1 - (embedding <=> %s::vector) as score
+                FROM fitment_rows
+                ORDER BY embedding <=> %s::vector
+                LIMIT %s)
+                UNION ALL
+                (SELECT id, content, metadata, 1 - (embedding <=> %s::vector) as score
+                FROM (
+                    SELECT id, content, metadata, embedding
+                    FROM documents
+                    WHERE fit_make IS NULL
+                    ORDER BY {column} {operator} {query_cast}
+                    LIMIT %s
+                ) general_rows
+                ORDER BY embedding <=> %s::vector
+                LIMIT %s)
+            ) candidates
+            ORDER BY score DESC
+            LIMIT %s
+            """
+            oversample = 1 if self.vector_storage == "full" else RESCORE_OVERSAMPLE
+            params = (*where_params, query_embedding_str, query_embedding_str, limit,
+                      query_embedding_str, query_embedding_str, limit * oversample,
+                      query_embedding_str, limit, limit)
+        elif self.vector_storage == "full":
+            sql_query = """
+            SELECT id, content, metadata, 1 - (embedding <=> %s::vector) as score
+            FROM documents
+            ORDER BY embedding <=> %s::vector
+            LIMIT %s
+            """
+            params = (query_embedding_str, query_embedding_str, limit)
+        else:
+            sql_query = f"""
+            SELECT id, content, metadata, 1 - (embedding <=> %s::vector) as score
+            FROM (
+                SELECT id, content, metadata, embedding
+                FROM documents
+                ORDER BY {column} {operator} {query_cast}
+                LIMIT %s
+            ) candidates
+            ORDER BY embedding <=> %s::vector
+            LIMIT %s
+            """
+            params = (query_embedding_str, query_embedding_str, limit * RESCORE_OVERSAMPLE,
+                      query_embedding_str, limit)
+        candidates = self._fetch_candidates(conn, sql_query, params, self._ann_settings(ef_search, probes))
+        sql_exec_end = time.time()
+        print(f"TIMING: Vector candidate query took {sql_exec_end - sql_exec_start:.4f} seconds")
+        return candidates
+
+    def _keyword_candidates(self, conn, keywords: str, limit: int,
+                            fitment: Dict[str, List] = None,
+                            text_config: str = "english") -> List[Dict[str, Any]]:
+        """Full-text top-N served by the content_tsv GIN index."""
+        sql_exec_start = time.time()
+        where, where_params = self._fitment_where(fitment)
+        candidates = self._fetch_candidates(
+            conn,
+            f"""
+            SELECT id, content, metadata, ts_rank(content_tsv, query) as score
+            FROM documents, to_tsquery(%s::regconfig, %s) query
+            WHERE content_tsv @@ query AND {where}
+            ORDER BY score DESC
+            LIMIT %s
+            """,
+            (text_config, keywords, *where_params, limit)
+        )
+        sql_exec_end = time.time()
+        print(f"TIMING: Keyword candidate query took {sql_exec_end - sql_exec_start:.4f} seconds")
+        return candidates
+
+    def _get_read_conn(self):
+        """Open the secondary read connection on first use."""
+        if self.read_conn is None or self.read_conn.closed:
+            self.read_conn = psycopg2.connect(**self.conn_params)
+        return self.read_conn
+
+    def _fusion_candidates(self, query_embedding_str: str, keywords: str, limit: int, hybrid_ratio: float,
+                           ef_search: int = None, probes: int = None,
+                           fitment: Dict[str, List] = None,
+                           text_config: str = "english") -> List[Dict[str, Any]]:
+        """
+        Run the ANN and full-text top-N queries concurrently and fuse them with RRF.
+        Vector hits with no keyword overlap are kept, unlike the weighted mode's filter.
+        """
+        vector_future = search_executor.submit(
+            self._vector_candidates, self.conn, query_embedding_str, limit, ef_search, probes, fitment
+        )
+        keyword_results = []
+        if keywords:
+            keyword_results = self._keyword_candidates(self._get_read_conn(), keywords, limit, fitment, text_config)
+        vector_results = vector_future.result()
+
+        fused = reciprocal_rank_fusion(
+            [vector_results, keyword_results],
+            weights=[hybrid_ratio, 1 - hybrid_ratio]
+        )
+        print(f"DEBUG: Fused {len(vector_results)} vector and {len(keyword_results)} keyword candidates")
+        return fused[:limit]
+
+    def _weighted_candidates(self, query_embedding_str: str, keywords: str, limit: int, hybrid_ratio: float,
+                             ef_search: int = None, probes: int = None,
+                             fitment: Dict[str, List] = None,
+                             text_config: str = "english") -> List[Dict[str, Any]]:
+        """Original single-statement hybrid: ts_rank and cosine similarity summed by hybrid_ratio."""
+        if not keywords:
+            return self._vector_candidates(self.conn, query_embedding_str, limit, ef_search, probes, fitment)
+
+        sql_exec_start = time.time()
+        where, where_params = self._fitment_where(fitment)
+        candidates = self._fetch_candidates(
+            self.conn,
+            f"""
+            SELECT id, content, metadata,
+                ts_rank(content_tsv, to_tsquery(%s::regconfig, %s)) * (1 - %s) +
+                (1 - (embedding <=> %s::vector)) * %s as hybrid_score
+            FROM documents
+            WHERE content_tsv @@ to_tsquery(%s::regconfig, %s) AND {where}
+            ORDER BY hybrid_score DESC
+            LIMIT %s
+            """,
+            (text_config, keywords, hybrid_ratio, query_embedding_str, hybrid_ratio,
+             text_config, keywords, *where_params, limit),
+            self._ann_settings(ef_search, probes)
+        )
+        sql_exec_end = time.time()
+        print(f"TIMING: SQL execution took {sql_exec_end - sql_exec_start:.4f} seconds")
+        return candidates
 
     def get_document_count(self) -> int:
         """Get the total number of documents in the database."""
@@ -409,24 +1119,69 @@ class VectorDB:
             cursor.execute("SELECT COUNT(*) FROM documents")
             return cursor.fetchone()[0]
 
+    def delete_documents(self, source: str) -> int:
+        """Delete every chunk of a source and its manifest entry. Returns the number of chunks deleted."""
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute("DELETE FROM documents WHERE metadata->>'source' = %s", (source,))
+                deleted = cursor.rowcount
+                cursor.execute("DELETE FROM ingest_manifest WHERE source = %s", (source,))
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            raise
+        return deleted
+
     def close(self):
         """Close the database connection."""
         start_time = time.time()
         if self.conn:
             self.conn.close()
+        if self.read_conn:
+            self.read_conn.close()
         end_time = time.time()
         print(f"TIMING: Database connection close took {end_time - start_time:.4f} seconds")
 
     def is_connected(self):
-        """Check if the database connection is still valid."""
+        """
+        Check if the database connection is still valid.
+        A broken secondary read connection is closed so it reopens on next use.
+        """
+        if self.read_conn is not None and not self.read_conn.closed:
+            try:
+                with self.read_conn.cursor() as cursor:
+                    cursor.execute("SELECT 1")
+                self.read_conn.rollback()
+            except Exception:
+                self.read_conn.close()
         try:
             with self.conn.cursor() as cursor:
                 cursor.execute("SELECT 1")
-                return True
+            self.conn.rollback()
+            return True
         except:
             return False
 
     def reconnect(self):
         """Reconnect to the database if connection is lost."""
         if not self.is_connected():
-            self.conn = psycopg2.connect(**self.conn_params)
\ No newline at end of file
+            self.conn = psycopg2.connect(**self.conn_params)
+
+def create_vector_store(conn_params: Dict[str, Any] = None, backend: str = VECTOR_BACKEND,
+                        setup: bool = True) -> VectorStore:
+    """
+    Return the configured vector store. The pgvector backend opens a new VectorDB on
+    conn_params (running the schema setup unless setup=False); the numpy backend
+    returns one shared store per process.
+    """
+    if backend == "numpy":
+        if not hasattr(create_vector_store, "numpy_store"):
+            from NumpyStore import NumpyVectorStore
+            create_vector_store.numpy_store = NumpyVectorStore(
+                NUMPY_STORE_DIR, EMBED_MODEL_ID, EMBED_DIM,
+                index_type=NUMPY_INDEX, nprobe=IVF_NPROBE, fitment_filter=FITMENT_FILTER
+            )
+        return create_vector_store.numpy_store
+    if backend == "pgvector":
+        return VectorDB(conn_params, setup=setup)
+    raise ValueError(f"Unknown vector store backend: {backend}")
@@ -1,9 +1,13 @@
-from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, status
+from fastapi import FastAPI, UploadFile, File, Form, Depends, HTTPException, Request, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from pydantic import BaseModel
-from Retrieve import process_query
-from VectorTools import process_documents, VectorDB
+from Retrieve import (process_query, stream_query, answer_cache, db_pool, warm_llm, admission, query_flights,
+                      translation_memory, run_blocking)
+from Admission import Overloaded
+from VectorTools import create_vector_store, query_embedding_cache, warm_embedding_model, get_embedding_batcher
+from Rerank import get_reranker
 import time
 import os
 import shutil
@@ -16,6 +20,8 @@ import asyncio
 from concurrent.futures import ThreadPoolExecutor
 import threading
 import uuid
+import json
+import weakref
 import uvicorn
 
 # Load environment variables
@@ -26,6 +32,10 @@ ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 ADMIN_EMAIL = os.environ.get("ADMIN_EMAIL")
 ADMIN_PASS = os.environ.get("ADMIN_PASS")
+# Header the reverse proxy sets to the client address (e.g. X-Real-IP with nginx's
+# "proxy_set_header X-Real-IP $remote_addr"). Unset by default: with no proxy in front,
+# or one that passes client headers through, any forwarding header is client-controlled
+TRUSTED_PROXY_HEADER = os.environ.get("TRUSTED_PROXY_HEADER", "").strip().lower()
 
 # Password hashing for admin login
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
@@ -115,6 +125,24 @@ class UserTracker:
                 }
             }
 
+# Warmup state for the readiness endpoint
+class ReadinessTracker:
+    def __init__(self, components: List[str]):
+        self.lock = threading.Lock()
+        self.components = {name: {"status": "pending"} for name in components}
+
+    def update(self, name: str, status: str, **details):
+        with self.lock:
+            self.components[name] = {"status": status, **details}
+
+    def is_ready(self):
+        with self.lock:
+            return all(info["status"] == "ready" for info in self.components.values())
+
+    def get_status(self):
+        with self.lock:
+            return {name: dict(info) for name, info in self.components.items()}
+
 # Global user tracker instance
 user_tracker = UserTracker()
 
@@ -218,9 +246,67 @@ os.makedirs(TEMP_DIR, exist_ok=True)
 class QueryRequest(BaseModel):
     query: str
 
-# Create a thread pool executor for handling concurrent requests
+# Thread pool for startup warmup; queries use Retrieve's executors
 thread_pool = ThreadPoolExecutor(max_workers=10)
 
+# Uploads are ingested one at a time off the event loop. Docling conversion processes
+# per upload: the default of 1 converts in the ingest thread instead of forking the API
+# worker; bulk loads belong in ingest.py
+ingest_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest")
+UPLOAD_INGEST_WORKERS = int(os.environ.get("UPLOAD_INGEST_WORKERS", 1))
+
+# Everything the first query would otherwise load lazily, warmed at startup
+WARMUP_STEPS = {
+    "embedding_model": warm_embedding_model,
+    "db_pool": db_pool.prewarm,
+    "llm": warm_llm,
+    "reranker": lambda: get_reranker().warm(),
+}
+WARMUP_RETRY_SECONDS = float(os.environ.get("WARMUP_RETRY_SECONDS", 15))
+readiness = ReadinessTracker(list(WARMUP_STEPS))
+warmup_tasks = []
+
+async def warm_component(name: str, warm):
+    """Run one warmup step in the thread pool, retrying until it succeeds."""
+    loop = asyncio.get_event_loop()
+    attempt = 0
+    while True:
+        attempt += 1
+        readiness.update(name, "warming", attempt=attempt)
+        start_time = time.time()
+        try:
+            await loop.run_in_executor(thread_pool, warm)
+        except Exception as e:
+            print(f"Warmup of {name} failed (attempt {attempt}): {e}")
+            readiness.update(name, "failed", attempt=attempt, error=str(e))
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+            continue
+        elapsed = time.time() - start_time
+        print(f"TIMING: Warmup of {name} took {elapsed:.4f} seconds")
+        readiness.update(name, "ready", seconds=round(elapsed, 4))
+        return
+
+@app.on_event("startup")
+async def start_warmup():
+    """Warm every component in the background; /ready reports when they are all hot."""
+    for name, warm in WARMUP_STEPS.items():
+        warmup_tasks.append(asyncio.ensure_future(warm_component(name, warm)))
+
+@app.on_event("shutdown")
+async def stop_warmup_and_pool():
+    for task in warmup_tasks:
+        task.cancel()
+    db_pool.close()
+
+@app.get("/ready")
+async def get_readiness():
+    """Readiness probe: 200 once every warmup step has finished, 503 until then."""
+    ready = readiness.is_ready()
+    return JSONResponse(
+        status_code=200 if ready else 503,
+        content={"ready": ready, "components": readiness.get_status()}
+    )
+
 @app.get("/")
 async def root():
     return {"message": "Welcome to the API"}
@@ -229,10 +315,49 @@ async def root():
 async def get_status():
     """Get current status of active queries"""
     status = user_tracker.get_status()
+    status["query_embedding_cache"] = query_embedding_cache.stats()
+    batcher = get_embedding_batcher()
+    status["embedding_batcher"] = batcher.stats() if batcher is not None else None
+    status["answer_cache"] = answer_cache.stats()
+    status["reranker"] = get_reranker().stats()
+    status["db_pool"] = db_pool.stats()
+    status["admission"] = admission.stats()
+    status["query_flights"] = query_flights.stats()
+    status["translation_memory"] = translation_memory.stats()
     return status
 
+def get_client_id(request: Request) -> str:
+    """
+    Client address for per-client fairness: the socket peer, unless TRUSTED_PROXY_HEADER
+    names the header our proxy sets. For X-Forwarded-For only the last entry, the one
+    the proxy appended, is used; earlier entries come from the client.
+    """
+    if TRUSTED_PROXY_HEADER:
+        value = request.headers.get(TRUSTED_PROXY_HEADER, "")
+        if TRUSTED_PROXY_HEADER == "x-forwarded-for":
+            value = value.split(",")[-1]
+        if value.strip():
+            return value.strip()
+    return request.client.host if request.client else "anonymous"
+
+def overloaded_response(error: Overloaded) -> JSONResponse:
+    """429 telling the client when to try again."""
+    print(f"Rejected query: {error} (retry after {error.retry_after}s)")
+    return JSONResponse(
+        status_code=429,
+        headers={"Retry-After": str(error.retry_after)},
+        content={"error": str(error), "retry_after": error.retry_after}
+    )
+
 @app.post("/query/")
-async def my_query_endpoint(query: QueryRequest):
+async def my_query_endpoint(query: QueryRequest, request: Request):
+    # Turn the query away now rather than queue it behind a backlog it can't clear in time
+    client_id = get_client_id(request)
+    try:
+        admission.admit(client_id)
+    except Overloaded as e:
+        return overloaded_response(e)
+
     # Generate unique user ID for this request
     user_id = str(uuid.uuid4())
     
@@ -242,12 +367,9 @@ async def my_query_endpoint(query: QueryRequest):
     user_tracker.start_query(user_id, query.query)
     
     try:
-        # Process the query asynchronously
+        # Process the query on the event loop; its blocking steps run on Retrieve's executors
         process_start_time = time.time()
-        
-        # Run the query processing in a thread pool to avoid blocking
-        loop = asyncio.get_event_loop()
-        result = await loop.run_in_executor(thread_pool, lambda: asyncio.run(process_query(query.query)))
+        result = await process_query(query.query, client_id)
         
         process_end_time = time.time()
         process_time = process_end_time - process_start_time
@@ -279,6 +401,58 @@ async def my_query_endpoint(query: QueryRequest):
     finally:
         # End tracking this query
         user_tracker.end_query(user_id)
+        admission.done(client_id, time.time() - total_start_time)
+
+def sse_event(event: str, data: dict) -> str:
+    """Format one server-sent event."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/query/stream")
+async def stream_query_endpoint(query: QueryRequest, request: Request):
+    """
+    Same as /query/ but answers as server-sent events: "sources" once retrieval is done,
+    "token" events as the LLM writes the answer, then "done" with timing (or "error").
+    """
+    client_id = get_client_id(request)
+    try:
+        admission.admit(client_id)
+    except Overloaded as e:
+        return overloaded_response(e)
+
+    user_id = str(uuid.uuid4())
+    start_time = time.time()
+    user_tracker.start_query(user_id, query.query)
+    finished = []
+
+    def finish():
+        if not finished:
+            finished.append(True)
+            user_tracker.end_query(user_id)
+            admission.done(client_id, time.time() - start_time)
+
+    async def events():
+        try:
+            async for event, data in stream_query(query.query, client_id):
+                if event == "done":
+                    # Events can be shared with coalesced requests, so copy before adding to it
+                    data = dict(data, concurrency_info={
+                        "user_id": user_id,
+                        "was_concurrent": user_tracker.get_status()['active_count'] > 1
+                    })
+                yield sse_event(event, data)
+        finally:
+            # Also runs when the client disconnects mid-answer
+            finish()
+
+    body = events()
+    # A client that disconnects before the first event leaves the generator unstarted,
+    # so its finally never runs; release the admission slot when it is collected
+    weakref.finalize(body, finish)
+    return StreamingResponse(body, media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Stop nginx buffering the stream until the answer is complete
+        "X-Accel-Buffering": "no",
+    })
 
 @app.post("/query/token")
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends()):
@@ -295,6 +469,33 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+def save_upload(file: UploadFile, file_path: str):
+    """Copy an uploaded file into the temp directory."""
+    with open(file_path, "wb") as buffer:
+        shutil.copyfileobj(file.file, buffer)
+
+def ingest_uploads(category: str) -> dict:
+    """Ingest the files saved in TEMP_DIR. Runs on ingest_executor, never on the event loop."""
+    conn_params = {
+        "host": "localhost",
+        "port": 5432,
+        "database": "FreedomRacing",
+        "user": "postgres",
+        "password": POSTGRESPASS
+    }
+    # The schema was created at deploy time
+    vector_db = create_vector_store(conn_params, setup=False)
+    try:
+        # Stream documents through convert -> embed -> write. Docling is only
+        # imported here so query-only workers never load it.
+        from IngestTools import ingest_directory
+        sync_stats = ingest_directory(vector_db, TEMP_DIR, category, workers=UPLOAD_INGEST_WORKERS)
+    finally:
+        vector_db.close()
+    # ingest_directory has already told every worker to drop cached answers built
+    # from the re-uploaded sources
+    return sync_stats
+
 @app.post("/query/upload")
 async def upload_files(
     files: List[UploadFile] = File(...),
@@ -318,45 +519,17 @@ async def upload_files(
                 continue
                 
             file_path = os.path.join(TEMP_DIR, file.filename)
-            with open(file_path, "wb") as buffer:
-                shutil.copyfileobj(file.file, buffer)
+            await run_blocking(ingest_executor, save_upload, file, file_path)
             saved_files.append(file_path)
             print(f"Saved file: {file.filename}")
 
         if not saved_files:
             return {"error": "No valid files were uploaded"}
 
-        # Initialize vector DB
-        conn_params = {
-            "host": "localhost",
-            "port": 5432,
-            "database": "FreedomRacing",
-            "user": "postgres",
-            "password": POSTGRESPASS
-        }
-        vector_db = VectorDB(conn_params)
-
-        # Process documents
         process_start_time = time.time()
-        processed_docs = process_documents(TEMP_DIR, category)
+        sync_stats = await run_blocking(ingest_executor, ingest_uploads, category)
         process_end_time = time.time()
-        print(f"TIMING: Document processing time: {process_end_time - process_start_time:.4f} seconds")
-
-        # Prepare documents and metadata for vector DB
-        documents = []
-        metadatas = []
-        for doc in processed_docs:
-            if hasattr(doc, 'page_content'):
-                documents.append(doc.page_content)
-            else:
-                documents.append(str(doc))
-            metadatas.append(doc.metadata)
-
-        # Add to vector DB
-        db_start_time = time.time()
-        vector_db.add_documents(documents, metadatas)
-        db_end_time = time.time()
-        print(f"TIMING: Database insertion time: {db_end_time - db_start_time:.4f} seconds")
+        print(f"TIMING: Document ingestion time: {process_end_time - process_start_time:.4f} seconds")
 
         upload_end_time = time.time()
         total_time = upload_end_time - upload_start_time
@@ -364,10 +537,10 @@ async def upload_files(
 
         return {
             "message": "Files processed and added to vector database successfully",
+            "sync": sync_stats,
             "api_timing": {
                 "total_time": f"{total_time:.4f} seconds",
-                "processing_time": f"{process_end_time - process_start_time:.4f} seconds",
-                "db_insertion_time": f"{db_end_time - db_start_time:.4f} seconds"
+                "processing_time": f"{process_end_time - process_start_time:.4f} seconds"
             }
         }
 
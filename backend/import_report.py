@@ -0,0 +1,99 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Measure import time and resident memory of the backend modules, each in a fresh
+# interpreter, and check that the query service doesn't load the ingestion stack.
+# Exits non-zero on a forbidden import or when a query module exceeds the limits,
+# so it can run as a check before deploying.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Modules loaded by the uvicorn query workers, and by ingestion only
+QUERY_MODULES = ["VectorTools", "Retrieve", "api"]
+INGEST_MODULES = ["IngestTools"]
+
+# Packages the query modules must not load at import time. sklearn comes in with
+# sentence_transformers (its evaluators import sklearn.metrics), which query workers
+# only import when the embedding model or reranker is first loaded, at warmup
+INGEST_ONLY_PACKAGES = ["docling", "langchain_docling", "sklearn", "pandas"]
+
+MEASURE = """
+import json, sys, time
+def rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / (1024 * 1024 if sys.platform == "darwin" else 1024)
+baseline = rss_mb()
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{
+    "seconds": seconds,
+    "rss_mb": rss_mb(),
+    "import_rss_mb": rss_mb() - baseline,
+    "loaded": [name for name in {packages!r} if name in sys.modules],
+}}))
+"""
+
+
+def measure(module: str) -> dict:
+    """Import module in a fresh interpreter and return its timing, memory and heavy packages."""
+    code = MEASURE.format(module=module, packages=INGEST_ONLY_PACKAGES)
+    result = subprocess.run([sys.executable, "-c", code], cwd=SCRIPT_DIR,
+                            capture_output=True, text=True)
+    if result.returncode != 0:
+        return {"module": module, "error": result.stderr.strip().splitlines()[-1] if result.stderr else "failed"}
+    # Modules print their own startup logging; the measurement is the last line
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["module"] = module
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report import time and RSS of the backend modules")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="fail if a query module takes longer than this to import")
+    parser.add_argument("--max-rss-mb", type=float, default=None,
+                        help="fail if a query module's process RSS after import exceeds this")
+    parser.add_argument("--json", action="store_true", help="print the reports as JSON")
+    args = parser.parse_args()
+
+    reports = [measure(module) for module in QUERY_MODULES + INGEST_MODULES]
+    problems = []
+    for report in reports:
+        if "error" in report:
+            problems.append(f"{report['module']}: import failed ({report['error']})")
+            continue
+        if report["module"] not in QUERY_MODULES:
+            continue
+        if report["loaded"]:
+            problems.append(f"{report['module']}: loads ingestion-only packages {report['loaded']}")
+        if args.max_seconds is not None and report["seconds"] > args.max_seconds:
+            problems.append(f"{report['module']}: import took {report['seconds']:.2f}s (limit {args.max_seconds}s)")
+        if args.max_rss_mb is not None and report["rss_mb"] > args.max_rss_mb:
+            problems.append(f"{report['module']}: RSS {report['rss_mb']:.0f} MB (limit {args.max_rss_mb} MB)")
+
+    if args.json:
+        print(json.dumps({"reports": reports, "problems": problems}, indent=2))
+    else:
+        print(f"{'module':<14}{'import s':>10}{'RSS MB':>10}{'+MB':>10}  ingestion packages")
+        for report in reports:
+            if "error" in report:
+                print(f"{report['module']:<14}{'error':>10}")
+                continue
+            print(f"{report['module']:<14}{report['seconds']:>10.2f}{report['rss_mb']:>10.0f}"
+                  f"{report['import_rss_mb']:>10.0f}  {', '.join(report['loaded']) or '-'}")
+        for problem in problems:
+            print(f"FAIL: {problem}")
+
+    sys.exit(1 if problems else 0)
@@ -1,10 +1,12 @@
 import os
 from dotenv import load_dotenv
-from VectorTools import VectorDB, process_documents
+from VectorTools import create_vector_store
+from IngestTools import ingest_directory
 
 # Get the directory where this script is located
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 DOC_LOAD_DIR = os.path.join(SCRIPT_DIR, "TempDocumentStore")
+CHECKPOINT_FILE = os.path.join(SCRIPT_DIR, "ingest_checkpoint.json")
 
 # Constants
 EMBED_MODEL_ID = "BAAI/bge-m3"
@@ -24,8 +26,8 @@ if __name__ == "__main__":
         "password": POSTGRESPASS
     }
 
-    # Initialize vector DB
-    vector_db = VectorDB(conn_params)
+    # Initialize vector store (pgvector or embedded, per VECTOR_BACKEND)
+    vector_db = create_vector_store(conn_params)
 
     # Check final document count
     starting_count = vector_db.get_document_count()
@@ -33,26 +35,10 @@ if __name__ == "__main__":
 
     category = input("What is the category of this data?/nEnter:")
 
-    processed_docs = process_documents(DOC_LOAD_DIR, category)
-
-    documents = []
-    metadatas = []
-
-    for doc in processed_docs:
-        # Extract the document content
-        if hasattr(doc, 'page_content'):
-            documents.append(doc.page_content)
-        else:
-            # Fall back to string representation if no page_content attribute
-            documents.append(str(doc))
-        
-        # Use the trimmed metadata we created
-        metadatas.append(doc.metadata)
-    
-    print(f"Prepared {len(documents)} documents for vector DB")
-    
-    # Add documents to vector DB
-    vector_db.add_documents(documents, metadatas)
+    # Stream files through convert -> embed -> write, resuming from the last
+    # checkpoint if a previous run with this category was interrupted. Running API
+    # workers drop cached answers built from each source as soon as it is written.
+    stats = ingest_directory(vector_db, DOC_LOAD_DIR, category, checkpoint_path=CHECKPOINT_FILE)
 
     # Check final document count
     final_count = vector_db.get_document_count()
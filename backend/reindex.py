@@ -0,0 +1,54 @@
+import os
+import argparse
+from dotenv import load_dotenv
+from VectorTools import VectorDB, VECTOR_INDEX_TYPE, VECTOR_STORAGE, VECTOR_STORAGE_MODES, vector_index_params
+
+# Load environment variables from .env file
+load_dotenv()
+POSTGRESPASS = os.environ.get("POSTGRESPASS")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Set up the schema, or inspect, rebuild or migrate the documents embedding index")
+    parser.add_argument("command", choices=["setup", "status", "rebuild", "migrate", "parts"],
+                        help="setup creates or updates the schema (run at deploy time, before the API); "
+                             "migrate adds the --storage column for existing rows and rebuilds the index on it; "
+                             "parts indexes part numbers in rows stored before the part_numbers table")
+    parser.add_argument("--type", default=VECTOR_INDEX_TYPE, choices=["hnsw", "ivfflat"],
+                        help="index type to build (default: %(default)s)")
+    parser.add_argument("--storage", default=VECTOR_STORAGE, choices=list(VECTOR_STORAGE_MODES),
+                        help="vector representation to index (default: %(default)s)")
+    parser.add_argument("--blocking", action="store_true",
+                        help="rebuild with a plain CREATE INDEX instead of CONCURRENTLY")
+    args = parser.parse_args()
+
+    # Connection parameters
+    conn_params = {
+        "host": "localhost",
+        "port": 5432,
+        "database": "FreedomRacing",
+        "user": "postgres",
+        "password": POSTGRESPASS
+    }
+
+    # setup_database adds and backfills the generated column for the chosen storage mode
+    vector_db = VectorDB(conn_params, vector_storage=args.storage)
+    try:
+        row_count = vector_db.get_document_count()
+        index = vector_db.get_vector_index()
+        print(f"Documents: {row_count}")
+        print(f"Current index: {index[1] if index else 'none'}")
+
+        if args.command == "setup":
+            print("Schema is up to date")
+        elif args.command == "status":
+            print(f"Recommended {args.type} parameters: {vector_index_params(args.type, row_count)}")
+        elif args.command == "parts":
+            print(f"Indexed {vector_db.backfill_part_numbers()} part numbers")
+        else:
+            # Concurrent rebuilds keep serving searches from the old index until the swap
+            vector_db.build_vector_index(args.type, concurrently=not args.blocking)
+            print(f"New index: {vector_db.get_vector_index()[1]}")
+            if args.command == "migrate":
+                print(f"Set VECTOR_STORAGE={args.storage} for the API and ingest so queries use the new index")
+    finally:
+        vector_db.close()